@@ -4,3 +4,7 @@ from django.apps import AppConfig
 class ChatSessionConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'chat_session'
+
+    def ready(self):
+        # Registers the chat session maintenance tasks with the job worker.
+        from chat_session import jobs
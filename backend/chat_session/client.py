@@ -0,0 +1,264 @@
+import os
+import time
+import random
+import asyncio
+import threading
+from contextlib import asynccontextmanager
+from functools import lru_cache
+from typing import AsyncIterator, Dict, Optional
+from weakref import WeakKeyDictionary
+
+import httpx
+import requests
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import InvalidHeader
+from urllib3.util.retry import Retry
+
+
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+# Responses telling that the request was not processed, the only ones a non-idempotent request is retried on.
+REJECTED_STATUSES = (429, 503)
+
+
+class UpstreamRetry(Retry):
+    """
+    Retry that waits at most UPSTREAM_RETRY_AFTER_MAX seconds for the Retry-After header of a response.
+    """
+    def get_retry_after(self, response) -> float | None:
+        retry_after = super().get_retry_after(response)
+        return None if retry_after is None else min(retry_after, settings.UPSTREAM_RETRY_AFTER_MAX)
+
+
+class UpstreamUnavailable(Exception):
+    """
+    Raised without touching the network while the circuit breaker of an upstream is open.
+    """
+
+
+class CircuitBreaker:
+    """
+    Opens after a number of consecutive failures and lets a single trial request
+    through once the reset timeout has passed.
+    """
+    def __init__(self, failure_threshold: int, reset_timeout: float):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self.lock = threading.Lock()
+
+    def allow(self) -> bool:
+        with self.lock:
+            if self.opened_at is None:
+                return True
+            if time.monotonic() - self.opened_at >= self.reset_timeout:
+                # Half-open: the next failure re-opens the circuit for a full period.
+                self.opened_at = time.monotonic()
+                return True
+            return False
+
+    def record_success(self):
+        with self.lock:
+            self.failures = 0
+            self.opened_at = None
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            if self.failures >= self.failure_threshold:
+                self.opened_at = time.monotonic()
+
+
+class UpstreamClient:
+    """
+    Pooled keep-alive HTTP client for a single upstream service.
+
+    Requests are retried with jittered exponential backoff on connection errors and
+    429/5xx responses, and fail fast with UpstreamUnavailable while the circuit is open.
+    Requests to a non-`idempotent` upstream, which may bill or act twice, are only retried
+    when they did not reach it: on connection errors and 429/503 responses.
+    """
+    def __init__(self, name: str, base_url: str = '', headers: Optional[Dict[str, str]] = None,
+                 connect_timeout: float = settings.UPSTREAM_CONNECT_TIMEOUT,
+                 read_timeout: float = settings.UPSTREAM_READ_TIMEOUT,
+                 max_retries: int = settings.UPSTREAM_MAX_RETRIES,
+                 circuit_breaker: Optional[CircuitBreaker] = None,
+                 idempotent: bool = True):
+        self.name = name
+        self.base_url = base_url.rstrip('/')
+        self.timeout = (connect_timeout, read_timeout)
+        self.circuit_breaker = circuit_breaker
+
+        retry = UpstreamRetry(
+            total=max_retries,
+            # A read error means the request was sent and may be processed already.
+            read=None if idempotent else 0,
+            other=None if idempotent else 0,
+            backoff_factor=settings.UPSTREAM_BACKOFF_FACTOR,
+            backoff_jitter=settings.UPSTREAM_BACKOFF_JITTER,
+            status_forcelist=RETRY_STATUSES if idempotent else REJECTED_STATUSES,
+            # Every method is retried, the upstreams take searches as POST.
+            allowed_methods=None,
+            raise_on_status=False,
+        )
+        adapter = HTTPAdapter(pool_connections=settings.UPSTREAM_POOL_CONNECTIONS,
+                              pool_maxsize=settings.UPSTREAM_POOL_MAXSIZE, max_retries=retry)
+
+        self.session = requests.Session()
+        self.session.headers.update(headers or {})
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+    def request(self, method: str, url: str, **kwargs) -> requests.Response:
+        if self.circuit_breaker and not self.circuit_breaker.allow():
+            raise UpstreamUnavailable(f'{self.name} is unavailable, try again later.')
+
+        kwargs.setdefault('timeout', self.timeout)
+        try:
+            response = self.session.request(method, f'{self.base_url}{url}', **kwargs)
+        except requests.RequestException:
+            if self.circuit_breaker:
+                self.circuit_breaker.record_failure()
+            raise
+
+        if self.circuit_breaker:
+            if response.status_code in RETRY_STATUSES:
+                self.circuit_breaker.record_failure()
+            else:
+                self.circuit_breaker.record_success()
+
+        return response
+
+    def get(self, url: str, **kwargs) -> requests.Response:
+        return self.request('GET', url, **kwargs)
+
+    def post(self, url: str, **kwargs) -> requests.Response:
+        return self.request('POST', url, **kwargs)
+
+
+class AsyncUpstreamClient:
+    """
+    Asyncio counterpart of UpstreamClient for long-running streamed requests.
+
+    Connection errors are retried by the transport, 429/5xx responses (429/503 for a
+    non-`idempotent` upstream) are retried before the response body is handed out, after
+    their Retry-After header like UpstreamClient does, or with jittered exponential backoff.
+    """
+    def __init__(self, name: str, base_url: str = '', headers: Optional[Dict[str, str]] = None,
+                 connect_timeout: float = settings.UPSTREAM_CONNECT_TIMEOUT,
+                 read_timeout: float = settings.UPSTREAM_READ_TIMEOUT,
+                 max_retries: int = settings.UPSTREAM_MAX_RETRIES,
+                 circuit_breaker: Optional[CircuitBreaker] = None,
+                 idempotent: bool = True):
+        self.name = name
+        self.max_retries = max_retries
+        self.circuit_breaker = circuit_breaker
+        self.retry_statuses = RETRY_STATUSES if idempotent else REJECTED_STATUSES
+
+        limits = httpx.Limits(max_connections=settings.ASYNC_UPSTREAM_MAX_CONNECTIONS,
+                              max_keepalive_connections=settings.UPSTREAM_POOL_MAXSIZE)
+        self.client = httpx.AsyncClient(
+            base_url=base_url.rstrip('/'),
+            headers=headers,
+            timeout=httpx.Timeout(read_timeout, connect=connect_timeout),
+            transport=httpx.AsyncHTTPTransport(retries=max_retries, limits=limits),
+        )
+
+    @asynccontextmanager
+    async def stream(self, method: str, url: str, **kwargs) -> AsyncIterator[httpx.Response]:
+        if self.circuit_breaker and not self.circuit_breaker.allow():
+            raise UpstreamUnavailable(f'{self.name} is unavailable, try again later.')
+
+        for attempt in range(self.max_retries + 1):
+            try:
+                response = await self.client.send(self.client.build_request(method, url, **kwargs), stream=True)
+            except httpx.HTTPError:
+                if self.circuit_breaker:
+                    self.circuit_breaker.record_failure()
+                raise
+
+            if response.status_code not in self.retry_statuses or attempt == self.max_retries:
+                break
+
+            await response.aclose()
+            await asyncio.sleep(self.retry_delay(response, attempt))
+
+        if self.circuit_breaker:
+            if response.status_code in RETRY_STATUSES:
+                self.circuit_breaker.record_failure()
+            else:
+                self.circuit_breaker.record_success()
+
+        try:
+            yield response
+        finally:
+            await response.aclose()
+
+    @staticmethod
+    def retry_delay(response: httpx.Response, attempt: int) -> float:
+        retry_after = None
+        if response.status_code in Retry.RETRY_AFTER_STATUS_CODES:
+            try:
+                retry_after = UpstreamRetry().get_retry_after(response)
+            except InvalidHeader:
+                pass
+
+        if retry_after:
+            return retry_after
+        return (settings.UPSTREAM_BACKOFF_FACTOR * 2 ** attempt
+                + random.uniform(0, settings.UPSTREAM_BACKOFF_JITTER))
+
+
+def new_circuit_breaker() -> CircuitBreaker:
+    return CircuitBreaker(failure_threshold=settings.UPSTREAM_CIRCUIT_FAILURES,
+                          reset_timeout=settings.UPSTREAM_CIRCUIT_RESET_TIMEOUT)
+
+
+@lru_cache(maxsize=None)
+def get_llm_circuit_breaker() -> CircuitBreaker:
+    # Shared by the sync and async clients, both talk to the same provider.
+    return new_circuit_breaker()
+
+
+def get_llm_headers() -> Dict[str, str]:
+    return {
+        'Content-Type': 'application/json',
+        'Helicone-Auth': f'Bearer {os.environ["HELICONE_API_KEY"]}',
+        'Authorization': f'Bearer {os.environ["TOGETHER_API_KEY"]}'
+    }
+
+
+@lru_cache(maxsize=None)
+def get_llm_client() -> UpstreamClient:
+    return UpstreamClient('LLM provider', base_url=os.environ['HELICONE_URL'], headers=get_llm_headers(),
+                          read_timeout=settings.LLM_READ_TIMEOUT, circuit_breaker=get_llm_circuit_breaker(),
+                          idempotent=False)
+
+
+# Async connection pools can only be used from the event loop that created them.
+async_llm_clients: 'WeakKeyDictionary[asyncio.AbstractEventLoop, AsyncUpstreamClient]' = WeakKeyDictionary()
+
+
+def get_async_llm_client() -> AsyncUpstreamClient:
+    loop = asyncio.get_running_loop()
+    if loop not in async_llm_clients:
+        async_llm_clients[loop] = AsyncUpstreamClient(
+            'LLM provider', base_url=os.environ['HELICONE_URL'], headers=get_llm_headers(),
+            read_timeout=settings.LLM_READ_TIMEOUT, circuit_breaker=get_llm_circuit_breaker(),
+            idempotent=False)
+    return async_llm_clients[loop]
+
+
+@lru_cache(maxsize=None)
+def get_search_client() -> UpstreamClient:
+    return UpstreamClient('Search provider', base_url=os.environ['SERPER_URL'], headers={
+        'X-API-KEY': os.environ['SERPER_API_KEY'],
+        'Content-Type': 'application/json'
+    }, circuit_breaker=new_circuit_breaker())
+
+
+@lru_cache(maxsize=None)
+def get_pages_client() -> UpstreamClient:
+    return UpstreamClient('Source pages', connect_timeout=settings.SOURCES_CONNECT_TIMEOUT,
+                          read_timeout=settings.SOURCES_READ_TIMEOUT, max_retries=1)
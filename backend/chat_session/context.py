@@ -0,0 +1,120 @@
+import re
+import math
+from collections import Counter
+from typing import Dict, List, Tuple
+
+import numpy as np
+
+
+WORD_PATTERN = re.compile(r'\w+')
+# Llama tokenizers average roughly four characters of English text per token.
+CHARACTERS_PER_TOKEN = 4
+BM25_K1 = 1.5
+BM25_B = 0.75
+HASHING_DIMENSIONS = 2048
+
+
+def estimate_tokens(text: str) -> int:
+    return math.ceil(len(text) / CHARACTERS_PER_TOKEN)
+
+
+def split_passages(text: str, passage_words: int) -> List[str]:
+    """
+    Split the text into passages of about `passage_words` words along line boundaries,
+    cutting lines that are longer than a passage on their own.
+    """
+    passages, lines, words_count = [], [], 0
+
+    for line in text.splitlines():
+        words = line.split()
+        while len(words) > passage_words:
+            if lines:
+                passages.append('\n'.join(lines))
+                lines, words_count = [], 0
+            passages.append(' '.join(words[:passage_words]))
+            words = words[passage_words:]
+
+        if words:
+            lines.append(' '.join(words))
+            words_count += len(words)
+
+        if words_count >= passage_words:
+            passages.append('\n'.join(lines))
+            lines, words_count = [], 0
+
+    if lines:
+        passages.append('\n'.join(lines))
+
+    return passages
+
+
+def bm25_scores(passages_words: List[List[str]], query_terms: List[str]) -> np.ndarray:
+    query_terms = list(dict.fromkeys(query_terms))
+    if not passages_words or not query_terms:
+        return np.zeros(len(passages_words))
+
+    term_frequencies = np.zeros((len(passages_words), len(query_terms)))
+    for i, words in enumerate(passages_words):
+        counts = Counter(words)
+        term_frequencies[i] = [counts[term] for term in query_terms]
+
+    lengths = np.array([len(words) for words in passages_words], dtype=float)
+    length_norm = BM25_K1 * (1 - BM25_B + BM25_B * lengths / max(lengths.mean(), 1))
+
+    document_frequencies = (term_frequencies > 0).sum(axis=0)
+    idf = np.log((len(passages_words) - document_frequencies + 0.5) / (document_frequencies + 0.5) + 1)
+
+    saturated = term_frequencies * (BM25_K1 + 1) / (term_frequencies + length_norm[:, None])
+    return saturated @ idf
+
+
+def hashed_vectors(passages_words: List[List[str]]) -> np.ndarray:
+    """
+    L2-normalized hashed bag-of-words vectors, used to compare passages for near duplicates.
+    """
+    vectors = np.zeros((len(passages_words), HASHING_DIMENSIONS), dtype=np.float32)
+    for i, words in enumerate(passages_words):
+        np.add.at(vectors[i], [hash(word) % HASHING_DIMENSIONS for word in words], 1)
+
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.maximum(norms, 1)
+
+
+def pack_context(sources: List[Dict[str, str]], query_terms: List[str], token_budget: int,
+                 passage_words: int = 120, duplicate_threshold: float = 0.85) -> Tuple[List[List[str]], Dict[str, int]]:
+    """
+    Choose the passages of the sources most relevant to the query terms that fit the token budget.
+
+    Passages are ranked with BM25, near duplicates of already chosen passages are skipped,
+    and the result keeps every source's passages in their original order. Returns the
+    passages per source and the token counts of the full and packed context.
+    """
+    passages = [(source_index, passage) for source_index, source in enumerate(sources)
+                for passage in split_passages(source.get('content') or '', passage_words)]
+    passages_words = [WORD_PATTERN.findall(passage.casefold()) for _, passage in passages]
+
+    scores = bm25_scores(passages_words, [term.casefold() for term in query_terms])
+    vectors = hashed_vectors(passages_words)
+    # Stable sort keeps earlier passages, i.e. better ranked sources, first among equal scores.
+    ranking = np.argsort(-scores, kind='stable')
+
+    chosen, used_tokens = [], 0
+    for index in ranking:
+        tokens = estimate_tokens(passages[index][1])
+        if used_tokens + tokens > token_budget:
+            continue
+        if chosen and float((vectors[chosen] @ vectors[index]).max()) >= duplicate_threshold:
+            continue
+
+        chosen.append(index)
+        used_tokens += tokens
+
+    packed = [[] for _ in sources]
+    for index in sorted(chosen):
+        source_index, passage = passages[index]
+        packed[source_index].append(passage)
+
+    return packed, {
+        'total_tokens': sum(estimate_tokens(source.get('content') or '') for source in sources),
+        'packed_tokens': used_tokens
+    }
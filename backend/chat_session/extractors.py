@@ -0,0 +1,107 @@
+from html.parser import HTMLParser
+from typing import Callable, Dict, List
+
+from bs4 import BeautifulSoup
+from django.conf import settings
+
+
+BOILERPLATE_TAGS = frozenset((
+    'script', 'style', 'noscript', 'template', 'svg', 'canvas', 'iframe', 'object',
+    'nav', 'header', 'footer', 'aside', 'form', 'button', 'select', 'dialog'
+))
+MAIN_CONTENT_TAGS = frozenset(('main', 'article'))
+BLOCK_TAGS = frozenset((
+    'address', 'article', 'blockquote', 'br', 'dd', 'div', 'dl', 'dt', 'figcaption', 'figure',
+    'h1', 'h2', 'h3', 'h4', 'h5', 'h6', 'hr', 'li', 'main', 'ol', 'p', 'pre', 'section',
+    'table', 'td', 'th', 'tr', 'ul'
+))
+# Main content shorter than this is assumed to be a teaser rather than the page body.
+MIN_MAIN_CONTENT_LENGTH = 500
+
+
+class TextExtractor(HTMLParser):
+    """
+    Streaming tokenizer that collects page text without building a document tree.
+
+    Text inside boilerplate elements is dropped as it is parsed, and text inside
+    <main>/<article> (or role="main") is additionally collected on its own.
+    """
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.skipped_tags: List[str] = []
+        # The tag that opened each main content region, with the number of same-named tags open inside it.
+        self.main_tags: List[List[str | int]] = []
+        self.text: List[str] = []
+        self.main_text: List[str] = []
+
+    def handle_starttag(self, tag, attrs):
+        if tag in BOILERPLATE_TAGS:
+            self.skipped_tags.append(tag)
+        elif tag in MAIN_CONTENT_TAGS or ('role', 'main') in attrs:
+            self.main_tags.append([tag, 0])
+        elif self.main_tags and self.main_tags[-1][0] == tag:
+            self.main_tags[-1][1] += 1
+
+        if tag in BLOCK_TAGS:
+            self.handle_data('\n')
+
+    def handle_startendtag(self, tag, attrs):
+        if tag in BLOCK_TAGS:
+            self.handle_data('\n')
+
+    def handle_endtag(self, tag):
+        if tag in self.skipped_tags:
+            # Closing a boilerplate element also closes anything left open inside it.
+            del self.skipped_tags[len(self.skipped_tags) - self.skipped_tags[::-1].index(tag) - 1:]
+        elif tag in ('body', 'html'):
+            # An unclosed boilerplate element must not swallow the rest of the page.
+            self.skipped_tags.clear()
+            self.main_tags.clear()
+        elif self.main_tags and self.main_tags[-1][0] == tag:
+            # Only the closing tag matching the one that opened the region ends it.
+            if self.main_tags[-1][1]:
+                self.main_tags[-1][1] -= 1
+            else:
+                self.main_tags.pop()
+
+        if tag in BLOCK_TAGS:
+            self.handle_data('\n')
+
+    def handle_data(self, data):
+        if self.skipped_tags:
+            return
+
+        self.text.append(data)
+        if self.main_tags:
+            self.main_text.append(data)
+
+
+def extract_text_streaming(html: str, main_only: bool = False) -> str:
+    parser = TextExtractor()
+    parser.feed(html)
+    parser.close()
+
+    if main_only:
+        main_text = ''.join(parser.main_text)
+        if len(main_text.strip()) >= MIN_MAIN_CONTENT_LENGTH:
+            return main_text
+
+    return ''.join(parser.text)
+
+
+def extract_text_soup(html: str, main_only: bool = False) -> str:
+    return BeautifulSoup(html, 'html.parser').get_text()
+
+
+EXTRACTORS: Dict[str, Callable[..., str]] = {
+    'streaming': extract_text_streaming,
+    'soup': extract_text_soup,
+}
+
+
+def extract_text(html: str) -> str:
+    """
+    Extract the readable text of an HTML page with the engine set in PAGE_EXTRACTOR.
+    """
+    extractor = EXTRACTORS[settings.PAGE_EXTRACTOR]
+    return extractor(html, main_only=settings.PAGE_EXTRACTOR_MAIN_ONLY)
@@ -0,0 +1,97 @@
+import bz2
+import lzma
+import zlib
+from typing import Callable, Dict, NamedTuple
+
+from django.conf import settings
+from django.db import models
+
+
+class Codec(NamedTuple):
+    header: int
+    compress: Callable[[bytes, int], bytes]
+    decompress: Callable[[bytes], bytes]
+
+
+# The header byte is written in front of every stored value, never change the byte of a codec.
+CODECS: Dict[str, Codec] = {
+    'none': Codec(0, lambda data, level: data, lambda data: data),
+    'zlib': Codec(1, lambda data, level: zlib.compress(data, level), zlib.decompress),
+    'lzma': Codec(2, lambda data, level: lzma.compress(data, preset=level), lzma.decompress),
+    'bz2': Codec(3, lambda data, level: bz2.compress(data, level), bz2.decompress),
+}
+CODECS_BY_HEADER: Dict[int, Codec] = {codec.header: codec for codec in CODECS.values()}
+
+
+def compress_text(text: str, codec: str | None = None, level: int | None = None) -> bytes:
+    """
+    Encode text as a codec header byte followed by the compressed UTF-8 bytes. Text shorter
+    than TEXT_COMPRESSION_MIN_BYTES, or that does not get smaller, is stored uncompressed.
+    """
+    data = text.encode()
+    codec = CODECS[codec or settings.TEXT_COMPRESSION_CODEC]
+    level = settings.TEXT_COMPRESSION_LEVEL if level is None else level
+
+    if len(data) >= settings.TEXT_COMPRESSION_MIN_BYTES:
+        compressed = codec.compress(data, level)
+        if len(compressed) < len(data):
+            return bytes((codec.header, )) + compressed
+
+    return bytes((CODECS['none'].header, )) + data
+
+
+def decompress_text(value: bytes | memoryview | str) -> str:
+    """
+    Decode a value written by compress_text. Values stored before the column was compressed,
+    plain UTF-8 bytes or str without a header, are returned as they are.
+    """
+    if isinstance(value, str):
+        return value
+
+    value = bytes(value)
+    codec = CODECS_BY_HEADER.get(value[0]) if value else None
+    if codec is not None:
+        try:
+            return codec.decompress(value[1:]).decode()
+        except (zlib.error, lzma.LZMAError, OSError, UnicodeDecodeError):
+            pass
+
+    return value.decode()
+
+
+class CompressedTextField(models.TextField):
+    """
+    A TextField stored as compressed bytes. Reads and writes str like a TextField, only
+    `isnull` lookups are meaningful on it.
+
+    The codec and level default to TEXT_COMPRESSION_CODEC and TEXT_COMPRESSION_LEVEL, changing
+    them applies to new writes, `manage.py backfill_compression` rewrites the stored values.
+    """
+    def __init__(self, *args, codec: str | None = None, level: int | None = None, **kwargs):
+        self.codec = codec
+        self.level = level
+        super().__init__(*args, **kwargs)
+
+    def deconstruct(self):
+        name, path, args, kwargs = super().deconstruct()
+        if self.codec is not None:
+            kwargs['codec'] = self.codec
+        if self.level is not None:
+            kwargs['level'] = self.level
+        return name, path, args, kwargs
+
+    def get_internal_type(self):
+        return 'BinaryField'
+
+    def from_db_value(self, value, expression, connection):
+        return None if value is None else decompress_text(value)
+
+    def get_db_prep_value(self, value, connection, prepared=False):
+        if not prepared:
+            value = self.get_prep_value(value)
+        if value is None:
+            return None
+        return connection.Database.Binary(self.compress(value))
+
+    def compress(self, text: str) -> bytes:
+        return compress_text(text, self.codec, self.level)
@@ -0,0 +1,279 @@
+import time
+import asyncio
+import logging
+import threading
+from datetime import timedelta
+from typing import AsyncGenerator, Dict, List, Tuple
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db.models import Q
+from django.utils import timezone
+
+from chat_session import metrics
+from chat_session.client import get_async_llm_client
+from chat_session.history import abuild_history
+from chat_session.models import ChatSession, ChatMessage
+from chat_session.services import LLM_MODEL, summarize_history_in_background
+from chat_session.streaming import UpstreamStreamError, coalesce_deltas, format_event, iter_deltas
+
+
+logger = logging.getLogger(__name__)
+
+
+class Generation:
+    """
+    A streamed assistant reply that runs independently of the connections reading it.
+
+    The reply is kept in memory as a list of chunks for the subscribers in this process
+    and saved to its ChatMessage in batches, so that subscribers in other processes and
+    reconnecting clients can read it from the database. A generation that has no
+    subscribers, and no reader polling it from another process, for STREAM_CANCEL_GRACE
+    seconds is cancelled.
+
+    Every save also refreshes the heartbeat of the message, which tells the readers in
+    other processes that the generation is still alive.
+    """
+    def __init__(self, message: ChatMessage):
+        self.message = message
+        self.chunks: List[str] = []
+        self.length = 0
+        self.error = None
+        self.done = False
+        self.changed = asyncio.Condition()
+        self.task = None
+        self.subscribers = 0
+        self.cancel_handle = None
+        self.cancel_check = None
+        self.saved_at = time.monotonic()
+
+    @property
+    def content(self) -> str:
+        return ''.join(self.chunks)
+
+    async def append(self, chunk: str):
+        async with self.changed:
+            self.chunks.append(chunk)
+            self.length += len(chunk)
+            self.changed.notify_all()
+
+    async def finish(self, error: str | None = None):
+        async with self.changed:
+            self.error = error
+            self.done = True
+            self.changed.notify_all()
+
+    def subscribe(self):
+        self.subscribers += 1
+        if self.cancel_handle is not None:
+            self.cancel_handle.cancel()
+            self.cancel_handle = None
+
+    def unsubscribe(self):
+        self.subscribers -= 1
+        if not self.subscribers:
+            self.schedule_cancel()
+
+    def schedule_cancel(self, delay: float | None = None):
+        # The grace period lets a client that lost its connection resume the reply.
+        self.cancel_handle = asyncio.get_running_loop().call_later(
+            settings.STREAM_CANCEL_GRACE if delay is None else delay, self.check_abandoned)
+
+    def check_abandoned(self):
+        self.cancel_handle = None
+        if not self.subscribers and not self.done and self.task is not None:
+            self.cancel_check = asyncio.create_task(self.cancel_if_abandoned())
+
+    async def cancel_if_abandoned(self):
+        read_at = await ChatMessage.objects.filter(pk=self.message.pk).values_list('read_at', flat=True).afirst()
+        # A reader subscribed, or left and scheduled another check, in the meantime.
+        if self.subscribers or self.done or self.cancel_handle is not None:
+            return
+
+        if read_at is not None:
+            remaining = settings.STREAM_CANCEL_GRACE - (timezone.now() - read_at).total_seconds()
+            if remaining > 0:
+                self.schedule_cancel(remaining)
+                return
+
+        self.task.cancel()
+
+
+# Generations running in this process, by the id of their ChatMessage.
+generations: Dict[int, Generation] = {}
+
+
+async def start_generation(chat_session: ChatSession) -> Generation:
+    history = await abuild_history(chat_session)
+    message = await ChatMessage.objects.acreate(chat_session=chat_session, role='assistant', content='',
+                                                status=ChatMessage.STATUS_STREAMING, heartbeat_at=timezone.now())
+
+    generation = Generation(message)
+    generations[message.id] = generation
+    generation.task = asyncio.create_task(run_generation(generation, history))
+    # Covers clients that disconnect before the response starts streaming.
+    generation.schedule_cancel()
+
+    return generation
+
+
+async def save_progress(generation: Generation, status: str = ChatMessage.STATUS_STREAMING):
+    await ChatMessage.objects.filter(pk=generation.message.pk).aupdate(content=generation.content, status=status,
+                                                                       heartbeat_at=timezone.now())
+    generation.saved_at = time.monotonic()
+
+
+async def keep_alive(generation: Generation):
+    """
+    Refresh the heartbeat of a generation while no chunk arrives to be saved.
+    """
+    while True:
+        await asyncio.sleep(settings.STREAM_SAVE_INTERVAL)
+        if time.monotonic() - generation.saved_at >= settings.STREAM_SAVE_INTERVAL:
+            await ChatMessage.objects.filter(pk=generation.message.pk).aupdate(heartbeat_at=timezone.now())
+            generation.saved_at = time.monotonic()
+
+
+def truncate_stale_replies(**filters) -> int:
+    """
+    End the streaming replies whose generation stopped refreshing their heartbeat for
+    STREAM_STALE_TIMEOUT seconds, because the process running it died. Replies with
+    content are kept as truncated, empty ones are deleted.
+    """
+    cutoff = timezone.now() - timedelta(seconds=settings.STREAM_STALE_TIMEOUT)
+    stale = ChatMessage.objects.filter(Q(heartbeat_at__lt=cutoff) | Q(heartbeat_at__isnull=True, timestamp__lt=cutoff),
+                                       status=ChatMessage.STATUS_STREAMING, **filters)
+
+    # The content column is compressed, whether a reply is empty is only known once it is read.
+    empty = [message.pk for message in stale.only('content') if not message.content]
+
+    # Both statements repeat the stale filters, a generation that saved in the meantime is left alone.
+    deleted, _ = stale.filter(pk__in=empty).delete()
+    return deleted + stale.exclude(pk__in=empty).update(status=ChatMessage.STATUS_TRUNCATED)
+
+
+async def run_generation(generation: Generation, history: List[Dict[str, str]]):
+    payload = {
+        'model': LLM_MODEL,
+        'stream': True,
+        'messages': history
+    }
+    error, cancelled = None, False
+    saved_length = 0
+    heartbeat = asyncio.create_task(keep_alive(generation))
+
+    try:
+        async with get_async_llm_client().stream('POST', '/v1/chat/completions', json=payload) as response:
+            if response.status_code != 200:
+                raise UpstreamStreamError(f'The LLM provider responded with HTTP {response.status_code}.')
+
+            chunks = coalesce_deltas(iter_deltas(response.aiter_lines()), max_delay=settings.STREAM_COALESCE_DELAY,
+                                     max_bytes=settings.STREAM_COALESCE_BYTES)
+            async for chunk in chunks:
+                await generation.append(chunk)
+
+                if (time.monotonic() - generation.saved_at >= settings.STREAM_SAVE_INTERVAL
+                        or generation.length - saved_length >= settings.STREAM_SAVE_CHARACTERS):
+                    await save_progress(generation)
+                    saved_length = generation.length
+    except asyncio.CancelledError:
+        # Leaving the stream context closes the upstream connection, which stops the generation.
+        logger.info('LLM stream of message %s cancelled, no client is reading it.', generation.message.pk)
+        cancelled = True
+    except Exception as e:
+        logger.warning('LLM stream of message %s failed: %s', generation.message.pk, e)
+        error = str(e) if isinstance(e, UpstreamStreamError) else 'The reply could not be generated.'
+    finally:
+        heartbeat.cancel()
+
+    try:
+        if cancelled:
+            await sync_to_async(metrics.increment)('streams_cancelled')
+
+        if (error or cancelled) and not generation.chunks:
+            await ChatMessage.objects.filter(pk=generation.message.pk).adelete()
+        else:
+            await save_progress(generation, ChatMessage.STATUS_TRUNCATED if cancelled else ChatMessage.STATUS_COMPLETE)
+            # Summarizing takes another LLM call, the client should not wait for it to end the stream.
+            threading.Thread(target=summarize_history_in_background,
+                             args=(generation.message.chat_session, ), daemon=True).start()
+    finally:
+        await generation.finish(error)
+        generations.pop(generation.message.pk, None)
+
+
+async def follow_generation(generation: Generation, offset: int) -> AsyncGenerator[Tuple[int, str], None]:
+    """
+    Yield (end offset, text) pairs of a generation running in this process, starting
+    at the character `offset` and waiting for new chunks until it finishes.
+    """
+    index, position = 0, 0
+    while True:
+        async with generation.changed:
+            await generation.changed.wait_for(lambda: len(generation.chunks) > index or generation.done)
+            chunks, done, error = generation.chunks[index:], generation.done, generation.error
+
+        for chunk in chunks:
+            index += 1
+            position += len(chunk)
+            if position > offset:
+                text = chunk[max(offset - (position - len(chunk)), 0):]
+                yield position, text
+
+        if done:
+            if error:
+                raise UpstreamStreamError(error)
+            return
+
+
+async def poll_message(message_id: int, offset: int) -> AsyncGenerator[Tuple[int, str], None]:
+    """
+    Yield (end offset, text) pairs of a reply saved by a generation in another process,
+    polling the database until it is no longer streaming or its heartbeat went stale.
+    Every poll records that the reply is being read, which keeps the generation running.
+    """
+    while True:
+        message = await (ChatMessage.objects.filter(pk=message_id)
+                         .only('content', 'status', 'heartbeat_at', 'timestamp').afirst())
+        if message is None:
+            raise UpstreamStreamError('The reply could not be generated.')
+
+        content = message.content or ''
+        if len(content) > offset:
+            yield len(content), content[offset:]
+            offset = len(content)
+
+        if message.status != ChatMessage.STATUS_STREAMING:
+            return
+        heartbeat_at = message.heartbeat_at or message.timestamp
+        if timezone.now() - heartbeat_at > timedelta(seconds=settings.STREAM_STALE_TIMEOUT):
+            await sync_to_async(truncate_stale_replies)(pk=message_id)
+            raise UpstreamStreamError('The reply was interrupted.')
+
+        await ChatMessage.objects.filter(pk=message_id).aupdate(read_at=timezone.now())
+        await asyncio.sleep(settings.STREAM_SAVE_INTERVAL)
+
+
+async def stream_reply_events(message_id: int, offset: int = 0) -> AsyncGenerator[str, None]:
+    """
+    Server-sent events of a reply from `offset` on, read from memory when it is generated
+    in this process and from the database otherwise. Every event id is `<message id>:<offset>`,
+    so a client that lost the connection can resume with the Last-Event-ID header.
+    """
+    generation = generations.get(message_id)
+    if generation is not None:
+        generation.subscribe()
+        reply = follow_generation(generation, offset)
+    else:
+        reply = poll_message(message_id, offset)
+
+    try:
+        yield format_event(None, event_id=f'{message_id}:{offset}')
+        async for end_offset, text in reply:
+            yield format_event(text, event_id=f'{message_id}:{end_offset}')
+    except UpstreamStreamError as e:
+        yield format_event(str(e), event='error')
+    finally:
+        # Runs when the client disconnects too, the ASGI handler cancels the response then.
+        if generation is not None:
+            generation.unsubscribe()
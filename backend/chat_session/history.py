@@ -0,0 +1,70 @@
+from typing import Dict, List, Tuple
+
+from django.conf import settings
+
+from chat_session.context import estimate_tokens
+from chat_session.models import ChatSession, ChatMessage
+
+
+def recent_messages_count() -> int:
+    # A turn is a user message and the assistant reply to it.
+    return settings.HISTORY_RECENT_TURNS * 2
+
+
+def load_messages(chat_session: ChatSession) -> List[ChatMessage]:
+    return list(chat_session.messages.select_related('body').order_by('timestamp', 'id'))
+
+
+async def aload_messages(chat_session: ChatSession) -> List[ChatMessage]:
+    return [message async for message in chat_session.messages.select_related('body').order_by('timestamp', 'id')]
+
+
+def split_history(messages: List[ChatMessage]) -> Tuple[List[ChatMessage], List[ChatMessage]]:
+    """
+    Split the session messages into the pinned context and the conversation that follows it.
+
+    The pinned context is the system prompt the session was created with and the
+    generated plan that answered it, everything after it is conversation.
+    """
+    pinned = messages[:1]
+    if len(messages) > 1 and messages[0].role == 'system' and messages[1].role == 'assistant':
+        pinned = messages[:2]
+
+    return pinned, messages[len(pinned):]
+
+
+def messages_to_summarize(chat_session: ChatSession, conversation: List[ChatMessage]) -> List[ChatMessage]:
+    """
+    Messages that dropped out of the verbatim window and are not yet folded into the summary.
+    """
+    older = conversation[:max(len(conversation) - recent_messages_count(), 0)]
+    if chat_session.summarized_until_id:
+        older = [message for message in older if message.id > chat_session.summarized_until_id]
+    return older
+
+
+def build_history(chat_session: ChatSession, messages: List[ChatMessage] | None = None) -> List[Dict[str, str]]:
+    """
+    Build the messages for an LLM request from the pinned context, the rolling summary
+    and the most recent messages, dropping the oldest of the latter to fit HISTORY_TOKEN_BUDGET.
+    """
+    if messages is None:
+        messages = load_messages(chat_session)
+    pinned, conversation = split_history(messages)
+
+    context = [{'role': message.role, 'content': message.text or ''} for message in pinned]
+    if chat_session.summary:
+        context.append({'role': 'system', 'content': f'Summary of the earlier conversation: {chat_session.summary}'})
+
+    recent = [{'role': message.role, 'content': message.text or ''}
+              for message in conversation[max(len(conversation) - recent_messages_count(), 0):]]
+
+    tokens = sum(estimate_tokens(message['content']) for message in context + recent)
+    while len(recent) > 1 and tokens > settings.HISTORY_TOKEN_BUDGET:
+        tokens -= estimate_tokens(recent.pop(0)['content'])
+
+    return context + recent
+
+
+async def abuild_history(chat_session: ChatSession) -> List[Dict[str, str]]:
+    return build_history(chat_session, await aload_messages(chat_session))
@@ -0,0 +1,17 @@
+from django.conf import settings
+
+from chat_session.generations import truncate_stale_replies
+from chat_session.services import evict_cached_pages
+from job.services import periodic
+
+
+@periodic(settings.STREAM_STALE_TIMEOUT)
+def truncate_abandoned_replies():
+    # Covers the replies nobody was reading when the process generating them died.
+    truncate_stale_replies()
+
+
+@periodic(settings.PAGE_CACHE_EVICT_INTERVAL)
+def evict_page_cache():
+    # Sizing up the whole cache takes too long to run on every request that stores pages.
+    evict_cached_pages()
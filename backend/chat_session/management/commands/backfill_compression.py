@@ -0,0 +1,90 @@
+import time
+
+from django.apps import apps
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+
+from chat_session.fields import CODECS, CompressedTextField, compress_text, decompress_text
+
+
+def megabytes(size: int) -> str:
+    return f'{size / 1024 / 1024:,.2f} MB'
+
+
+class Command(BaseCommand):
+    help = ('Rewrite the values of every CompressedTextField with the configured codec and level, '
+            'and report the storage saved and the cost of reading the values back.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500, help='Rows read and written per transaction.')
+        parser.add_argument('--codec', choices=list(CODECS), help='Defaults to TEXT_COMPRESSION_CODEC.')
+        parser.add_argument('--level', type=int, help='Defaults to TEXT_COMPRESSION_LEVEL.')
+        parser.add_argument('--dry-run', action='store_true', help='Only report what the backfill would save.')
+
+    def handle(self, *args, **options):
+        fields = [field for model in apps.get_models() for field in model._meta.concrete_fields
+                  if isinstance(field, CompressedTextField)]
+
+        for field in fields:
+            self.backfill(field, options)
+
+        if not options['dry_run'] and connection.vendor == 'postgresql':
+            self.stdout.write('Run VACUUM FULL or pg_repack on the tables above to return the freed space.')
+
+    def backfill(self, field: CompressedTextField, options):
+        quote = connection.ops.quote_name
+        table, column = quote(field.model._meta.db_table), quote(field.column)
+        pk_column = quote(field.model._meta.pk.column)
+        table_size = self.table_size(field.model)
+
+        rows, rewritten, stored_before, stored_after, text_size, decode_time = 0, 0, 0, 0, 0, 0.0
+        last_pk = None
+        while True:
+            with transaction.atomic(), connection.cursor() as cursor:
+                after_last = '' if last_pk is None else f'AND {pk_column} > %s'
+                cursor.execute(f'SELECT {pk_column}, {column} FROM {table} WHERE {column} IS NOT NULL {after_last} '
+                               f'ORDER BY {pk_column} LIMIT %s',
+                               [options['batch_size']] if last_pk is None else [last_pk, options['batch_size']])
+                batch = cursor.fetchall()
+                if not batch:
+                    break
+
+                updates = []
+                for pk, value in batch:
+                    stored = value.encode() if isinstance(value, str) else bytes(value)
+                    text = decompress_text(value)
+                    encoded = compress_text(text, options['codec'], options['level'])
+
+                    started_at = time.perf_counter()
+                    decompress_text(encoded)
+                    decode_time += time.perf_counter() - started_at
+
+                    rows += 1
+                    stored_before += len(stored)
+                    stored_after += len(encoded)
+                    text_size += len(text.encode())
+                    # Values stored before the column was compressed may come back as str.
+                    if encoded != stored or isinstance(value, str):
+                        updates.append((connection.Database.Binary(encoded), pk))
+
+                if updates and not options['dry_run']:
+                    cursor.executemany(f'UPDATE {table} SET {column} = %s WHERE {pk_column} = %s', updates)
+                rewritten += len(updates)
+                last_pk = batch[-1][0]
+
+        saved = 1 - stored_after / stored_before if stored_before else 0
+        self.stdout.write(f'{field.model._meta.db_table}.{field.column}: {rows:,} values, '
+                          f'{rewritten:,} {"to rewrite" if options["dry_run"] else "rewritten"}')
+        self.stdout.write(f'  stored {megabytes(stored_before)} -> {megabytes(stored_after)} ({saved:.1%} less to read), '
+                          f'{megabytes(text_size)} of text')
+        if text_size:
+            self.stdout.write(f'  decompressing costs {decode_time * 1000 / (text_size / 1024 / 1024):,.1f} ms per MB of text')
+        if table_size is not None:
+            self.stdout.write(f'  table size {megabytes(table_size)} before, {megabytes(self.table_size(field.model))} after')
+
+    def table_size(self, model) -> int | None:
+        if connection.vendor != 'postgresql':
+            return None
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT pg_total_relation_size(%s)', [model._meta.db_table])
+            return cursor.fetchone()[0]
@@ -0,0 +1,40 @@
+import time
+from pathlib import Path
+
+from django.core.management.base import BaseCommand, CommandError
+
+from chat_session.extractors import EXTRACTORS
+from chat_session.services import filter_text
+
+
+class Command(BaseCommand):
+    help = 'Compare the page text extractors on a directory of saved HTML pages.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('corpus', help='Directory with saved *.html pages.')
+        parser.add_argument('--repeat', type=int, default=3, help='Number of runs per page and extractor.')
+        parser.add_argument('--main-only', action='store_true', help='Keep only the main-content region.')
+
+    def handle(self, *args, **options):
+        pages = sorted(Path(options['corpus']).glob('*.htm*'))
+        if not pages:
+            raise CommandError(f'No HTML pages found in {options["corpus"]}.')
+
+        documents = [page.read_text(encoding='utf-8', errors='replace') for page in pages]
+        self.stdout.write(f'{len(documents)} pages, {sum(map(len, documents)):,} characters of HTML')
+
+        for name, extractor in EXTRACTORS.items():
+            cpu_time, extracted_characters, filtered_characters = 0.0, 0, 0
+
+            for document in documents:
+                started_at = time.process_time()
+                for _ in range(options['repeat']):
+                    text = extractor(document, main_only=options['main_only'])
+                    filtered_text = filter_text(text)
+                cpu_time += (time.process_time() - started_at) / options['repeat']
+                extracted_characters += len(text)
+                filtered_characters += len(filtered_text)
+
+            self.stdout.write(f'{name:>10}: {cpu_time / len(documents) * 1000:8.2f} ms CPU per page, '
+                              f'{extracted_characters / len(documents):10,.0f} characters extracted, '
+                              f'{filtered_characters / len(documents):10,.0f} kept after filtering')
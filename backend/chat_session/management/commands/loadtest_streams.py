@@ -0,0 +1,114 @@
+import time
+import json
+import asyncio
+import statistics
+
+import httpx
+from django.core.management.base import BaseCommand, CommandError
+
+
+class Command(BaseCommand):
+    help = ('Measure how many concurrent send_message streams the ASGI server (uvicorn) holds. Start '
+            'a fake LLM with --fake-llm, point HELICONE_URL of the server under test at it, then run '
+            'the load against the server. send_message only streams under ASGI, runserver answers 501. '
+            'Each open stream holds a database connection, so the database connection limit caps the result.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--fake-llm', type=int, metavar='PORT',
+                            help='Serve a fake streaming completions endpoint on this port instead of running the load.')
+        parser.add_argument('--tokens', type=int, default=200, help='Tokens streamed by the fake LLM per reply.')
+        parser.add_argument('--interval', type=float, default=0.05, help='Seconds between fake LLM tokens.')
+        parser.add_argument('--url', help='send_message URL of a chat session, e.g. http://localhost:8000/chats/<id>/send_message/')
+        parser.add_argument('--token', help='JWT access token of the session owner.')
+        parser.add_argument('--targets', help=('File with one "<url> <token>" pair per line, used in turn. '
+                                               'Sessions accept 20 messages, so larger runs need many sessions.'))
+        parser.add_argument('--streams', type=int, default=500, help='Number of concurrent streams to open.')
+        parser.add_argument('--message', default='Explain the topic briefly.')
+        parser.add_argument('--timeout', type=float, default=120)
+
+    def handle(self, *args, **options):
+        if options['fake_llm']:
+            asyncio.run(self.serve_fake_llm(options))
+        elif options['targets']:
+            with open(options['targets']) as targets:
+                asyncio.run(self.run_load(options, [line.split() for line in targets if line.strip()]))
+        elif options['url'] and options['token']:
+            asyncio.run(self.run_load(options, [(options['url'], options['token'])]))
+        else:
+            raise CommandError('Either --fake-llm, --targets or both --url and --token are required.')
+
+    async def serve_fake_llm(self, options):
+        async def handle_connection(reader, writer):
+            try:
+                while True:
+                    headers = await reader.readuntil(b'\r\n\r\n')
+                    content_length = 0
+                    for header in headers.decode('latin-1').split('\r\n'):
+                        if header.lower().startswith('content-length:'):
+                            content_length = int(header.split(':', 1)[1])
+                    await reader.readexactly(content_length)
+
+                    writer.write(b'HTTP/1.1 200 OK\r\nContent-Type: text/event-stream\r\n'
+                                 b'Transfer-Encoding: chunked\r\n\r\n')
+                    for index in range(options['tokens']):
+                        event = f'data: {json.dumps({"choices": [{"text": f"token{index} "}]})}\n\n'.encode()
+                        writer.write(b'%x\r\n%s\r\n' % (len(event), event))
+                        await writer.drain()
+                        await asyncio.sleep(options['interval'])
+
+                    event = b'data: [DONE]\n\n'
+                    writer.write(b'%x\r\n%s\r\n0\r\n\r\n' % (len(event), event))
+                    await writer.drain()
+            except (asyncio.IncompleteReadError, ConnectionError):
+                writer.close()
+
+        server = await asyncio.start_server(handle_connection, '0.0.0.0', options['fake_llm'], backlog=4096)
+        self.stdout.write(f'Fake LLM listening on port {options["fake_llm"]}, '
+                          f'{options["tokens"]} tokens every {options["interval"]}s per reply.')
+        async with server:
+            await server.serve_forever()
+
+    async def run_load(self, options, targets):
+        open_streams, peak_streams = 0, 0
+        first_frame_times, completed, failures = [], 0, {}
+
+        async def run_stream(client, url, token):
+            nonlocal open_streams, peak_streams, completed
+            started_at = time.monotonic()
+            try:
+                async with client.stream('POST', url, json={'message': options['message']},
+                                         headers={'Authorization': f'Bearer {token}'}) as response:
+                    if response.status_code != 200:
+                        raise RuntimeError(f'HTTP {response.status_code}')
+
+                    open_streams += 1
+                    peak_streams = max(peak_streams, open_streams)
+                    try:
+                        first_frame = True
+                        async for _ in response.aiter_bytes():
+                            if first_frame:
+                                first_frame_times.append(time.monotonic() - started_at)
+                                first_frame = False
+                    finally:
+                        open_streams -= 1
+                completed += 1
+            except Exception as e:
+                reason = str(e) or type(e).__name__
+                failures[reason] = failures.get(reason, 0) + 1
+
+        limits = httpx.Limits(max_connections=None, max_keepalive_connections=0)
+        async with httpx.AsyncClient(timeout=options['timeout'], limits=limits) as client:
+            started_at = time.monotonic()
+            await asyncio.gather(*(run_stream(client, *targets[index % len(targets)])
+                                   for index in range(options['streams'])))
+            elapsed = time.monotonic() - started_at
+
+        self.stdout.write(f'Streams requested: {options["streams"]}, completed: {completed}, '
+                          f'peak concurrently open: {peak_streams}, total time: {elapsed:.1f}s')
+        if first_frame_times:
+            first_frame_times.sort()
+            self.stdout.write(f'Time to first frame: p50 {statistics.median(first_frame_times):.2f}s, '
+                              f'p95 {first_frame_times[int(len(first_frame_times) * 0.95) - 1]:.2f}s, '
+                              f'max {first_frame_times[-1]:.2f}s')
+        for reason, count in failures.items():
+            self.stdout.write(f'Failed ({reason}): {count}')
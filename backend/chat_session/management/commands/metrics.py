@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+
+from chat_session import metrics
+
+
+class Command(BaseCommand):
+    help = 'Print the service counters and cache hit rates.'
+
+    def handle(self, *args, **options):
+        counters = metrics.snapshot()
+        if not counters:
+            self.stdout.write('No metrics recorded yet.')
+            return
+
+        for name, value in counters.items():
+            self.stdout.write(f'{name}: {value}')
+
+        for name in sorted(name[:-len('_hit')] for name in counters if name.endswith('_hit')):
+            self.stdout.write(f'{name} hit rate: {metrics.hit_rate(name):.1%}')
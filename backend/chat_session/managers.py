@@ -0,0 +1,84 @@
+import hashlib
+from collections import Counter
+from typing import Iterable, List
+
+from django.db import IntegrityError, models, transaction
+from django.db.models import Count, F, Max, OuterRef, Q, Subquery
+
+
+def content_digest(text: str) -> str:
+    return hashlib.sha256(text.encode()).hexdigest()
+
+
+class ChatSessionQuerySet(models.QuerySet):
+    def summaries(self):
+        """
+        Sessions without their rolling summary text, annotated with the number of
+        user messages and the time of the latest message.
+        """
+        return self.defer('summary').annotate(
+            messages_count=Count('messages', filter=Q(messages__role='user')),
+            last_message_at=Max('messages__timestamp'),
+        )
+
+
+class ChatMessageQuerySet(models.QuerySet):
+    def conversation(self):
+        """
+        User messages and the assistant replies that directly follow them, leaving out
+        the system prompt and the generated plan. Filtered in the database, so their
+        content is never loaded.
+        """
+        # A subquery rather than a window function, so that the filters of cursor pagination
+        # can't hide the preceding message of the first row of a page.
+        previous_role = (self.model.objects.filter(chat_session_id=OuterRef('chat_session_id'), id__lt=OuterRef('id'))
+                         .order_by('-id').values('role')[:1])
+        return self.annotate(previous_role=Subquery(previous_role)).filter(
+            Q(role='user') | Q(role='assistant', previous_role='user')
+        )
+
+
+class ContentQuerySet(models.QuerySet):
+    def acquire(self, contents: List[models.Model]):
+        """
+        Take a reference on the stored copy of each unsaved Content and set its primary key.
+        Texts are stored once per digest, a text that is stored already is not written again.
+        """
+        texts = {}
+        for content in contents:
+            content.digest = content_digest(content.text)
+            texts[content.digest] = content.text
+        references = Counter(content.digest for content in contents)
+
+        with transaction.atomic(savepoint=False):
+            for attempt in (1, 2):
+                # Locked, so that a concurrent release can't delete them before they are referenced.
+                stored = dict(self.select_for_update().filter(digest__in=references).values_list('digest', 'pk'))
+                try:
+                    with transaction.atomic():
+                        created = self.bulk_create([self.model(digest=digest, text=texts[digest])
+                                                    for digest in references if digest not in stored])
+                    break
+                except IntegrityError:
+                    # Inserted by a concurrent acquire in the meantime, it is locked on the second pass.
+                    if attempt == 2:
+                        raise
+
+            stored.update((content.digest, content.pk) for content in created)
+            for count in set(references.values()):
+                self.filter(pk__in=[stored[digest] for digest, n in references.items() if n == count]
+                            ).update(refcount=F('refcount') + count)
+
+        for content in contents:
+            content.pk = stored[content.digest]
+
+    def release(self, ids: Iterable[int]):
+        """
+        Drop a reference on each of the Content ids, deleting the ones no longer referenced.
+        """
+        references = Counter(ids)
+        with transaction.atomic(savepoint=False):
+            for count in set(references.values()):
+                self.filter(pk__in=[pk for pk, n in references.items() if n == count]
+                            ).update(refcount=F('refcount') - count)
+            self.filter(pk__in=references, refcount__lte=0).delete()
@@ -0,0 +1,32 @@
+from typing import Dict
+
+from django.db.models import F
+from django.utils import timezone
+
+from chat_session.models import Metric
+
+
+def increment(name: str, amount: int = 1):
+    """
+    Atomically add `amount` to the counter `name`, creating it on first use.
+    """
+    updated = Metric.objects.filter(name=name).update(value=F('value') + amount, updated_at=timezone.now())
+    if not updated:
+        metric, created = Metric.objects.get_or_create(name=name, defaults={'value': amount})
+        if not created:
+            Metric.objects.filter(pk=metric.pk).update(value=F('value') + amount, updated_at=timezone.now())
+
+
+def snapshot() -> Dict[str, int]:
+    return dict(Metric.objects.order_by('name').values_list('name', 'value'))
+
+
+def hit_rate(prefix: str) -> float | None:
+    """
+    Share of `<prefix>_hit` among `<prefix>_hit` and `<prefix>_miss` counters.
+    """
+    counters = snapshot()
+    hits, misses = counters.get(f'{prefix}_hit', 0), counters.get(f'{prefix}_miss', 0)
+    if not hits + misses:
+        return None
+    return hits / (hits + misses)
@@ -0,0 +1,27 @@
+# Generated by Django 5.1 on 2026-10-18 08:42
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat_session', '0002_metric'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CachedPage',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('url', models.TextField()),
+                ('url_hash', models.CharField(max_length=64, unique=True)),
+                ('content', models.TextField()),
+                ('etag', models.CharField(blank=True, max_length=255)),
+                ('last_modified', models.CharField(blank=True, max_length=64)),
+                ('size', models.PositiveIntegerField()),
+                ('fetched_at', models.DateTimeField()),
+                ('accessed_at', models.DateTimeField()),
+            ],
+        ),
+    ]
@@ -0,0 +1,46 @@
+from django.db import migrations
+from django.db.models import Q
+
+
+GENERATION_PROMPT_PREFIXES = (
+    '[Output only Markdown] Generate a detailed description for the topic',
+    '[Output only JSON] Generate exactly 5 unique questions on the topic',
+)
+
+
+def remove_generation_messages(apps, schema_editor):
+    """
+    Subtopic content and quiz generation used to append their prompt and the reply to
+    the chat history. Remove both, the results are stored on the subtopics already.
+    """
+    ChatMessage = apps.get_model('chat_session', 'ChatMessage')
+
+    prompts = Q()
+    for prefix in GENERATION_PROMPT_PREFIXES:
+        prompts |= Q(content__startswith=prefix)
+    prompt_ids = set(ChatMessage.objects.filter(prompts, role='system').values_list('id', flat=True))
+    if not prompt_ids:
+        return
+
+    session_ids = ChatMessage.objects.filter(id__in=prompt_ids).values_list('chat_session_id', flat=True).distinct()
+    removed_ids = set(prompt_ids)
+    for session_id in session_ids:
+        previous_id = None
+        for message_id, role in (ChatMessage.objects.filter(chat_session_id=session_id)
+                                 .order_by('timestamp', 'id').values_list('id', 'role')):
+            if role == 'assistant' and previous_id in prompt_ids:
+                removed_ids.add(message_id)
+            previous_id = message_id
+
+    ChatMessage.objects.filter(id__in=removed_ids).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat_session', '0004_chatsession_summary'),
+    ]
+
+    operations = [
+        migrations.RunPython(remove_generation_messages, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.1 on 2026-10-18 08:50
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat_session', '0005_remove_generation_messages'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='chatmessage',
+            name='status',
+            field=models.CharField(choices=[('complete', 'Complete'), ('streaming', 'Streaming')], default='complete', max_length=10),
+        ),
+    ]
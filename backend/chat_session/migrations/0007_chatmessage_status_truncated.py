@@ -0,0 +1,18 @@
+# Generated by Django 5.1 on 2026-10-18 08:52
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat_session', '0006_chatmessage_status'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='chatmessage',
+            name='status',
+            field=models.CharField(choices=[('complete', 'Complete'), ('streaming', 'Streaming'), ('truncated', 'Truncated')], default='complete', max_length=10),
+        ),
+    ]
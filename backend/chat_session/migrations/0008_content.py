@@ -0,0 +1,37 @@
+# Generated by Django 5.1 on 2026-10-18 14:20
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat_session', '0007_chatmessage_status_truncated'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Content',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('text', models.TextField()),
+            ],
+        ),
+        migrations.AddField(
+            model_name='chatmessage',
+            name='body',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='+', to='chat_session.content'),
+        ),
+        migrations.AddField(
+            model_name='chatsource',
+            name='body',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='+', to='chat_session.content'),
+        ),
+        # The source content becomes nullable, so that the rows moved by 0009 can drop their copy.
+        migrations.AlterField(
+            model_name='chatsource',
+            name='content',
+            field=models.TextField(null=True),
+        ),
+    ]
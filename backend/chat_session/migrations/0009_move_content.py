@@ -0,0 +1,69 @@
+# Generated by Django 5.1 on 2026-10-18 14:20
+
+from django.db import migrations
+
+
+BATCH_SIZE = 500
+
+
+def move_to_contents(model, rows, field: str):
+    """
+    Move the text of `field` of every row into a new Content row referenced by `body`.
+    """
+    Content = model._meta.get_field('body').related_model
+    batch = []
+    for row in rows.only('pk', field).iterator(chunk_size=BATCH_SIZE):
+        batch.append(row)
+        if len(batch) == BATCH_SIZE:
+            save_batch(model, Content, batch, field)
+            batch = []
+    if batch:
+        save_batch(model, Content, batch, field)
+
+
+def save_batch(model, Content, rows, field: str):
+    contents = Content.objects.bulk_create([Content(text=getattr(row, field)) for row in rows])
+    for row, content in zip(rows, contents):
+        row.body = content
+        setattr(row, field, None)
+    model.objects.bulk_update(rows, ['body', field])
+
+
+def move_from_contents(model, rows, field: str):
+    content_ids = []
+    for row in rows.select_related('body').iterator(chunk_size=BATCH_SIZE):
+        content_ids.append(row.body_id)
+        setattr(row, field, row.body.text)
+        row.body = None
+        row.save(update_fields=[field, 'body'])
+    model._meta.get_field('body').related_model.objects.filter(pk__in=content_ids).delete()
+
+
+def forwards(apps, schema_editor):
+    ChatSource = apps.get_model('chat_session', 'ChatSource')
+    ChatMessage = apps.get_model('chat_session', 'ChatMessage')
+
+    move_to_contents(ChatSource, ChatSource.objects.exclude(content=''), 'content')
+    move_to_contents(ChatMessage, ChatMessage.objects.filter(role='system').exclude(content__isnull=True)
+                     .exclude(content=''), 'content')
+
+
+def backwards(apps, schema_editor):
+    ChatSource = apps.get_model('chat_session', 'ChatSource')
+    ChatMessage = apps.get_model('chat_session', 'ChatMessage')
+
+    move_from_contents(ChatSource, ChatSource.objects.filter(body__isnull=False), 'content')
+    move_from_contents(ChatMessage, ChatMessage.objects.filter(body__isnull=False), 'content')
+
+
+class Migration(migrations.Migration):
+    # Kept apart from the schema changes of the tables it updates. On Postgres the foreign keys
+    # are deferred, and a table can't be altered while its deferred checks are pending.
+
+    dependencies = [
+        ('chat_session', '0008_content'),
+    ]
+
+    operations = [
+        migrations.RunPython(forwards, backwards),
+    ]
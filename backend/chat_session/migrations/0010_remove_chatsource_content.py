@@ -0,0 +1,17 @@
+# Generated by Django 5.1 on 2026-10-18 14:20
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat_session', '0009_move_content'),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name='chatsource',
+            name='content',
+        ),
+    ]
@@ -0,0 +1,92 @@
+# Generated by Django 5.1 on 2026-10-18 15:10
+
+import chat_session.fields
+from django.db import migrations
+
+
+COLUMNS = [('chatmessage', 'content'), ('content', 'text')]
+BATCH_SIZE = 500
+
+
+def compressed_field(old_field):
+    field = chat_session.fields.CompressedTextField(null=old_field.null, blank=old_field.blank)
+    field.set_attributes_from_name(old_field.name)
+    return field
+
+
+def compress_columns(apps, schema_editor):
+    """
+    Change the columns to bytes. Existing values stay plain UTF-8, which CompressedTextField
+    reads as is, until `manage.py backfill_compression` compresses them.
+    """
+    quote = schema_editor.quote_name
+    for model_name, field_name in COLUMNS:
+        model = apps.get_model('chat_session', model_name)
+        old_field = model._meta.get_field(field_name)
+
+        if schema_editor.connection.vendor == 'postgresql':
+            # A plain cast would read backslashes in the text as bytea escapes. The values are
+            # compressed already, so TOAST stores them out of line without compressing again.
+            column = quote(old_field.column)
+            schema_editor.execute(f"ALTER TABLE {quote(model._meta.db_table)} "
+                                  f"ALTER COLUMN {column} TYPE bytea USING convert_to({column}, 'UTF8'), "
+                                  f"ALTER COLUMN {column} SET STORAGE EXTERNAL")
+        else:
+            schema_editor.alter_field(model, old_field, compressed_field(old_field))
+
+
+def decompress_columns(apps, schema_editor):
+    quote = schema_editor.quote_name
+    postgresql = schema_editor.connection.vendor == 'postgresql'
+    for model_name, field_name in COLUMNS:
+        model = apps.get_model('chat_session', model_name)
+        old_field = model._meta.get_field(field_name)
+        table, column = quote(model._meta.db_table), quote(old_field.column)
+
+        value_sql = "convert_to(%s, 'UTF8')" if postgresql else '%s'
+        last_id = 0
+        with schema_editor.connection.cursor() as cursor:
+            while True:
+                cursor.execute(f'SELECT id, {column} FROM {table} WHERE id > %s AND {column} IS NOT NULL '
+                               f'ORDER BY id LIMIT %s', [last_id, BATCH_SIZE])
+                rows = cursor.fetchall()
+                if not rows:
+                    break
+                cursor.executemany(f'UPDATE {table} SET {column} = {value_sql} WHERE id = %s',
+                                   [(chat_session.fields.decompress_text(value), pk) for pk, value in rows])
+                last_id = rows[-1][0]
+
+        if postgresql:
+            schema_editor.execute(f"ALTER TABLE {table} "
+                                  f"ALTER COLUMN {column} TYPE text USING convert_from({column}, 'UTF8'), "
+                                  f"ALTER COLUMN {column} SET STORAGE EXTENDED")
+        else:
+            schema_editor.alter_field(model, compressed_field(old_field), old_field)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat_session', '0010_remove_chatsource_content'),
+        ('plan', '0005_remove_planitemsubtopic_content'),
+    ]
+
+    operations = [
+        migrations.SeparateDatabaseAndState(
+            state_operations=[
+                migrations.AlterField(
+                    model_name='chatmessage',
+                    name='content',
+                    field=chat_session.fields.CompressedTextField(blank=True, null=True),
+                ),
+                migrations.AlterField(
+                    model_name='content',
+                    name='text',
+                    field=chat_session.fields.CompressedTextField(),
+                ),
+            ],
+            database_operations=[
+                migrations.RunPython(compress_columns, decompress_columns),
+            ],
+        ),
+    ]
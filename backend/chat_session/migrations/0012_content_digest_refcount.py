@@ -0,0 +1,24 @@
+# Generated by Django 5.1 on 2026-10-18 16:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat_session', '0011_compress_text'),
+        ('plan', '0005_remove_planitemsubtopic_content'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='content',
+            name='digest',
+            field=models.CharField(max_length=64, null=True),
+        ),
+        migrations.AddField(
+            model_name='content',
+            name='refcount',
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
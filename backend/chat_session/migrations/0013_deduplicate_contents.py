@@ -0,0 +1,61 @@
+# Generated by Django 5.1 on 2026-10-18 16:05
+
+import hashlib
+from collections import defaultdict
+
+from django.db import migrations
+from django.db.models import Count, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+
+
+BATCH_SIZE = 500
+OWNERS = [('chat_session', 'ChatSource'), ('chat_session', 'ChatMessage'), ('plan', 'PlanItemSubtopic')]
+
+
+def deduplicate_contents(apps, schema_editor):
+    """
+    Keep the first Content row of every distinct text, point the rows referencing its
+    duplicates to it, count the references and delete the rows left unreferenced.
+    """
+    Content = apps.get_model('chat_session', 'Content')
+    owners = [apps.get_model(app_label, model_name) for app_label, model_name in OWNERS]
+
+    kept, duplicates, batch = {}, defaultdict(list), []
+    for content in Content.objects.only('pk', 'text').order_by('pk').iterator(chunk_size=BATCH_SIZE):
+        digest = hashlib.sha256(content.text.encode()).hexdigest()
+        if digest in kept:
+            duplicates[kept[digest]].append(content.pk)
+            continue
+
+        kept[digest] = content.pk
+        content.digest = digest
+        batch.append(content)
+        if len(batch) == BATCH_SIZE:
+            Content.objects.bulk_update(batch, ['digest'])
+            batch = []
+    Content.objects.bulk_update(batch, ['digest'])
+
+    for kept_pk, duplicate_pks in duplicates.items():
+        for owner in owners:
+            owner.objects.filter(body_id__in=duplicate_pks).update(body_id=kept_pk)
+
+    references = [
+        Coalesce(Subquery(owner.objects.filter(body_id=OuterRef('pk')).order_by().values('body_id')
+                          .annotate(count=Count('pk')).values('count')), Value(0))
+        for owner in owners
+    ]
+    Content.objects.update(refcount=sum(references[1:], references[0]))
+    Content.objects.filter(refcount=0).delete()
+
+
+class Migration(migrations.Migration):
+    # Kept apart from the schema changes of the tables it updates, see 0009_move_content.
+
+    dependencies = [
+        ('chat_session', '0012_content_digest_refcount'),
+    ]
+
+    operations = [
+        # Rows that are shared after the deduplication stay shared when it is reversed.
+        migrations.RunPython(deduplicate_contents, migrations.RunPython.noop),
+    ]
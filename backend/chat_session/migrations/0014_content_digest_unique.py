@@ -0,0 +1,18 @@
+# Generated by Django 5.1 on 2026-10-18 16:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat_session', '0013_deduplicate_contents'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='content',
+            name='digest',
+            field=models.CharField(max_length=64, unique=True),
+        ),
+    ]
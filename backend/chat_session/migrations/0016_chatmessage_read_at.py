@@ -0,0 +1,18 @@
+# Generated by Django 5.1 on 2026-10-18 09:28
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat_session', '0015_chatmessage_heartbeat_at'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='chatmessage',
+            name='read_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
@@ -1,8 +1,12 @@
 import uuid
 
-from django.db import models
+from django.db import models, transaction
+from django.db.models.signals import post_delete
 from django.conf import settings
 
+from chat_session.fields import CompressedTextField
+from chat_session.managers import ChatSessionQuerySet, ChatMessageQuerySet, ContentQuerySet
+
 
 class ChatSession(models.Model):
     id = models.UUIDField(default=uuid.uuid4, unique=True, 
@@ -10,37 +14,172 @@ class ChatSession(models.Model):
     user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
     created_at = models.DateTimeField(auto_now_add=True)
     is_active = models.BooleanField(default=True)
+    summary = models.TextField(blank=True, default='')
+    summarized_until = models.ForeignKey('ChatMessage', null=True, blank=True,
+                                         on_delete=models.SET_NULL, related_name='+')
+
+    objects = ChatSessionQuerySet.as_manager()
 
     def __str__(self):
         return f'ChatSession {self.id} with user {self.user}'
 
 
-class ChatSource(models.Model):
+class Content(models.Model):
+    """
+    Bulky text kept apart from the rows it belongs to, so that queries and joins over
+    sources, messages and subtopics scan narrow rows. Read through content_accessor.
+
+    Stored once per SHA-256 digest of the text and shared by every row with the same text,
+    `refcount` counts those rows. The last one to let go of it deletes it.
+    """
+    digest = models.CharField(max_length=64, unique=True)
+    refcount = models.PositiveIntegerField(default=0)
+    text = CompressedTextField()
+
+    objects = ContentQuerySet.as_manager()
+
+    def __str__(self):
+        return f'Content {self.pk} ({len(self.text)} characters)'
+
+
+def content_accessor(inline: str | None = None) -> property:
+    """
+    A str attribute backed by the Content row of the model's `body` foreign key.
+
+    The row is loaded on first access unless the query used select_related('body').
+    Assigning text stages a Content, acquired by ContentOwner.save or by ContentOwner.save_contents
+    before a bulk insert, which releases the replaced one. Models that keep short text in a
+    column of their own pass its name as `inline`, it is read when there is no body.
+    """
+    def get_text(instance):
+        if instance.body is not None:
+            return instance.body.text
+        return getattr(instance, inline) if inline else None
+
+    def set_text(instance, text):
+        if instance.body_id:
+            instance.replaced_content_ids.append(instance.body_id)
+        instance.body = Content(text=text) if text else None
+
+    return property(get_text, set_text)
+
+
+class ContentOwner:
+    """
+    Mixin for models with a `body` foreign key to Content.
+    """
+    @property
+    def replaced_content_ids(self) -> list:
+        # Content rows whose text was replaced, released once the new text is saved.
+        return self.__dict__.setdefault('_replaced_content_ids', [])
+
+    def staged_content(self) -> Content | None:
+        body = self._meta.get_field('body').get_cached_value(self, default=None)
+        return body if body is not None and body.pk is None else None
+
+    @staticmethod
+    def save_contents(instances):
+        """
+        Acquire the staged Content of all `instances` at once, before they are bulk inserted.
+        """
+        Content.objects.acquire([content for content in map(ContentOwner.staged_content, instances)
+                                 if content is not None])
+
+    def save(self, *args, **kwargs):
+        with transaction.atomic():
+            content = self.staged_content()
+            if content is not None:
+                Content.objects.acquire([content])
+            super().save(*args, **kwargs)
+
+            if self.replaced_content_ids:
+                Content.objects.release(self.replaced_content_ids)
+                self.replaced_content_ids.clear()
+
+
+def release_content(sender, instance, **kwargs):
+    if instance.body_id:
+        Content.objects.release([instance.body_id])
+
+
+class ChatSource(ContentOwner, models.Model):
+    MAX_PER_SESSION = 10
+
     chat_session = models.ForeignKey(ChatSession, on_delete=models.CASCADE, related_name='sources')
     title = models.CharField(max_length=255)
     url = models.URLField()
-    content = models.TextField()
+    body = models.ForeignKey(Content, null=True, blank=True, on_delete=models.PROTECT, related_name='+')
+
+    content = content_accessor()
 
     def __str__(self):
         return self.name
     
     def save(self, *args, **kwargs):
-        if self.chat_session.sources.count() >= 10:
-            raise ValueError("Can't add more than 10 sources to a chat session.")
+        # Sessions are created through ChatSessionSerializer, which checks the limit once for all sources.
+        if self.chat_session.sources.count() >= self.MAX_PER_SESSION:
+            raise ValueError(f"Can't add more than {self.MAX_PER_SESSION} sources to a chat session.")
         super().save(*args, **kwargs)
 
 
-class ChatMessage(models.Model):
+class ChatMessage(ContentOwner, models.Model):
     ROLE_TYPES = [
         ('system', 'System'),
         ('assistant', 'Assistant'),
         ('user', 'User'),
     ]
+    STATUS_COMPLETE = 'complete'
+    STATUS_STREAMING = 'streaming'
+    STATUS_TRUNCATED = 'truncated'
+    STATUS_TYPES = [
+        (STATUS_COMPLETE, 'Complete'),
+        (STATUS_STREAMING, 'Streaming'),
+        (STATUS_TRUNCATED, 'Truncated'),
+    ]
+    # Messages of these roles keep their text in a Content row, the others in the content column.
+    BODY_ROLES = ('system', )
 
     chat_session = models.ForeignKey(ChatSession, on_delete=models.CASCADE, related_name='messages')
     role = models.CharField(max_length=10, choices=ROLE_TYPES)
-    content = models.TextField(null=True, blank=True)
+    content = CompressedTextField(null=True, blank=True)
+    body = models.ForeignKey(Content, null=True, blank=True, on_delete=models.PROTECT, related_name='+')
+    status = models.CharField(max_length=10, choices=STATUS_TYPES, default=STATUS_COMPLETE)
     timestamp = models.DateTimeField(auto_now_add=True)
+    # Refreshed by the process generating a streaming reply while it is alive.
+    heartbeat_at = models.DateTimeField(null=True, blank=True)
+    # Refreshed by the readers polling a streaming reply from a process other than the generating one.
+    read_at = models.DateTimeField(null=True, blank=True)
+
+    objects = ChatMessageQuerySet.as_manager()
+
+    text = content_accessor(inline='content')
+
+    def __str__(self):
+        return f'{self.role}: {(self.text or "")[:50]}'
+
+
+post_delete.connect(release_content, sender=ChatSource)
+post_delete.connect(release_content, sender=ChatMessage)
+
+
+class Metric(models.Model):
+    name = models.CharField(max_length=100, unique=True)
+    value = models.BigIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f'{self.name}: {self.value}'
+
+
+class CachedPage(models.Model):
+    url = models.TextField()
+    url_hash = models.CharField(max_length=64, unique=True)
+    content = models.TextField()
+    etag = models.CharField(max_length=255, blank=True)
+    last_modified = models.CharField(max_length=64, blank=True)
+    size = models.PositiveIntegerField()
+    fetched_at = models.DateTimeField()
+    accessed_at = models.DateTimeField()
 
     def __str__(self):
-        return f'{self.role}: {self.content[:50]}'
+        return self.url
@@ -1,10 +1,12 @@
 from rest_framework import serializers
 from django.db import transaction
 
-from .models import ChatSession, ChatSource, ChatMessage
+from .models import ChatSession, ChatSource, ChatMessage, ContentOwner
 
 
 class ChatSourceSerializer(serializers.ModelSerializer):
+    content = serializers.CharField()
+
     class Meta:
         model = ChatSource
         fields = ['title', 'url', 'content']
@@ -18,7 +20,8 @@ class ChatMessageSerializer(serializers.ModelSerializer):
 
 class ChatSessionSerializer(serializers.ModelSerializer):
     sources = ChatSourceSerializer(many=True, write_only=True)
-    messages = ChatMessageSerializer(many=True)
+    # Written on creation, represented as the conversation only in to_representation.
+    messages = ChatMessageSerializer(many=True, write_only=True)
 
     class Meta:
         model = ChatSession
@@ -26,32 +29,55 @@ class ChatSessionSerializer(serializers.ModelSerializer):
         extra_kwargs = {
             'user': {'write_only': True}
         }
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # Pages fetched by the server can parse to no text, which is kept rather than failing the session.
+        if self.context.get('fetched_sources'):
+            self.fields['sources'].child.fields['content'].allow_blank = True
     
+    def validate_sources(self, sources):
+        if len(sources) > ChatSource.MAX_PER_SESSION:
+            raise serializers.ValidationError(f"Can't add more than {ChatSource.MAX_PER_SESSION} sources to a chat session.")
+        return sources
+
     def create(self, validated_data):
         with transaction.atomic():
             sources_data = validated_data.pop('sources', [])
             messages_data = validated_data.pop('messages', [])
             chat_session = ChatSession.objects.create(**validated_data)
 
-            for source in sources_data:
-                ChatSource.objects.create(chat_session=chat_session, **source)
-            
-            for message in messages_data:
-                ChatMessage.objects.create(chat_session=chat_session, **message)
+            sources = [ChatSource(chat_session=chat_session, **source) for source in sources_data]
+            messages = [ChatMessage(chat_session=chat_session, **message) for message in messages_data]
+            for message in messages:
+                if message.role in ChatMessage.BODY_ROLES:
+                    message.text, message.content = message.content, None
+
+            # Bulk inserts skip ChatSource.save, the source limit is checked in validate_sources.
+            ContentOwner.save_contents(sources + messages)
+            ChatSource.objects.bulk_create(sources)
+            ChatMessage.objects.bulk_create(messages)
         
         return chat_session
 
     def to_representation(self, instance):
         representation = super().to_representation(instance)
-        messages = self.instance.messages.order_by('timestamp').all()
-
-        filtered_messages = []
-        for i, message in enumerate(messages):
-            if message.role == 'user':
-                filtered_messages.append(ChatMessageSerializer(message).data)
-                if i + 1 < len(messages):
-                    if messages[i + 1].role == 'assistant':
-                        filtered_messages.append(ChatMessageSerializer(messages[i + 1]).data)
-        
-        representation['messages'] = filtered_messages
+        messages = instance.messages.conversation().only('id', 'chat_session_id', 'role', 'content').order_by('id')
+
+        representation['messages'] = ChatMessageSerializer(messages, many=True).data
         return representation
+
+
+class ChatSessionSummarySerializer(serializers.ModelSerializer):
+    messages_count = serializers.IntegerField(read_only=True)
+    last_message_at = serializers.DateTimeField(read_only=True)
+
+    class Meta:
+        model = ChatSession
+        fields = ['id', 'created_at', 'messages_count', 'last_message_at']
+
+
+class ChatHistoryMessageSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = ChatMessage
+        fields = ['id', 'role', 'content', 'status', 'timestamp']
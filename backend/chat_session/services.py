@@ -1,140 +1,344 @@
-import os
 import re
 import json
-from typing import Dict, Any, Generator, Union
+import hashlib
+import time
+import logging
+from datetime import timedelta
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+from typing import Dict, Any, Generator, List, Tuple, Union
 
 import requests
+from django.conf import settings
+from django.core.cache import caches
+from django.db import connection
+from django.db.models import F, Sum
+from django.utils import timezone
 from fix_busted_json import repair_json
-from bs4 import BeautifulSoup
 
-from chat_session.models import ChatSession, ChatMessage
+from chat_session import metrics
+from chat_session.models import ChatSession, ChatMessage, CachedPage
+from chat_session.context import pack_context
+from chat_session.history import build_history, load_messages, split_history, messages_to_summarize
+from chat_session.extractors import extract_text
+from chat_session.client import get_llm_client, get_search_client, get_pages_client
 
 
-def get_llama_response_stream(chat_session: ChatSession) -> Generator[str, None, None]:
-    url = f'{os.environ["HELICONE_URL"]}/v1/chat/completions'
-    messages = chat_session.messages.all()
-    payload = {
-        'model': 'meta-llama/Meta-Llama-3.1-8B-Instruct-Turbo',
-        'stream': True,
-        'messages': [{
-            'role': message.role,
-            'content': message.content
-        } for message in messages]
-    }
-    headers = {
-        'Content-Type': 'application/json',
-        'Helicone-Auth': f'Bearer {os.environ["HELICONE_API_KEY"]}',
-        'Authorization': f'Bearer {os.environ["TOGETHER_API_KEY"]}'
-    }
-
-    response = requests.post(url, headers=headers, json=payload, stream=True)
-    if response.status_code == 200:
-        accumulated_data = []
+logger = logging.getLogger(__name__)
 
-        for line in response.iter_lines():
-            if line:
-                decoded_line = line.decode('utf-8')
 
-                if decoded_line.startswith('data: '):
-                    decoded_line = decoded_line[len('data: '):]
+LLM_MODEL = 'meta-llama/Meta-Llama-3.1-8B-Instruct-Turbo'
 
-                try:
-                    data = json.loads(decoded_line).get('choices', [])[0].get('text')
-                    accumulated_data.append(data)
 
-                    processed_data = data.replace('\n', '\\n')
-                    yield f'data: {processed_data}\n\n'
-
-                except json.JSONDecodeError:
-                    break
-
-        response_content = ''.join(accumulated_data)
-        ChatMessage.objects.create(chat_session=chat_session, role='assistant', content=response_content)
-        return
-
-def get_llama_response(chat_session: ChatSession, is_json: bool) -> Union[Dict[str, Any], None]:
-    url = f'{os.environ["HELICONE_URL"]}/v1/chat/completions'
-    messages = chat_session.messages.all()
+def get_completion(messages: List[Dict[str, str]]) -> Union[str, None]:
     payload = {
-        'model': 'meta-llama/Meta-Llama-3.1-8B-Instruct-Turbo',
+        'model': LLM_MODEL,
         'stream': False,
-        'messages': [{
-            'role': message.role,
-            'content': message.content
-        } for message in messages]
-    }
-    headers = {
-        'Content-Type': 'application/json',
-        'Helicone-Auth': f'Bearer {os.environ["HELICONE_API_KEY"]}',
-        'Authorization': f'Bearer {os.environ["TOGETHER_API_KEY"]}'
+        'messages': messages
     }
 
-    response = requests.post(url, headers=headers, json=payload, stream=False)
+    response = get_llm_client().post('/v1/chat/completions', json=payload)
     if response.status_code == 200:
         response_json = response.json()
-        response_content = response_json.get('choices', [])[0].get('message', {}).get('content', '')
+        return response_json.get('choices', [])[0].get('message', {}).get('content', '')
+
+    return None
+
+
+def parse_json_response(response_content: str) -> Dict[str, Any]:
+    return json.loads(repair_json(response_content))
+
 
+def get_llama_response(chat_session: ChatSession, is_json: bool) -> Union[Dict[str, Any], None]:
+    response_content = get_completion(build_history(chat_session))
+    if response_content is not None:
         if is_json:
-            repaired_json = repair_json(response_content)
-            response_content = json.loads(repaired_json)
+            response_content = parse_json_response(response_content)
 
         ChatMessage.objects.create(chat_session=chat_session, role='assistant', content=response_content)
         return response_content
-    
+
     return None
 
 
+def summarize_history(chat_session: ChatSession):
+    """
+    Fold the messages that left the verbatim window into the rolling summary of the session.
+    """
+    _, conversation = split_history(load_messages(chat_session))
+    messages = messages_to_summarize(chat_session, conversation)
+    if not messages:
+        return
+
+    transcript = '\n'.join(f'{message.role}: {message.content}' for message in messages)
+    summary = get_completion([{
+        'role': 'system',
+        'content': ('Update the summary of a conversation between a student and a study assistant. '
+                    'Keep the facts, questions and explanations that later questions may refer to, '
+                    f'in no more than {settings.HISTORY_SUMMARY_WORDS} words. Output only the updated summary.')
+    }, {
+        'role': 'user',
+        'content': f'Current summary: {chat_session.summary or "(empty)"}\n\nNew messages:\n{transcript}'
+    }])
+
+    if summary:
+        chat_session.summary = summary
+        chat_session.summarized_until = messages[-1]
+        chat_session.save(update_fields=['summary', 'summarized_until'])
+
+
+def summarize_history_in_background(chat_session: ChatSession):
+    try:
+        summarize_history(chat_session)
+    except Exception:
+        logger.exception('Failed to summarize the history of %s', chat_session)
+    finally:
+        connection.close()
+
+
+STOP_WORDS = frozenset((
+    'a', 'an', 'and', 'are', 'as', 'at', 'be', 'by', 'for', 'from', 'how', 'in', 'into', 'is', 'it',
+    'of', 'on', 'or', 'the', 'to', 'what', 'with'
+))
+
+
+def normalize_query(query: str) -> str:
+    """
+    Case-fold the query, collapse whitespace, trim punctuation around words and drop
+    stop words, unless the query consists of stop words only.
+    """
+    words = [word.strip('.,:;!?\'"()[]{}') for word in query.casefold().split()]
+    words = [word for word in words if word]
+    significant_words = [word for word in words if word not in STOP_WORDS]
+
+    return ' '.join(significant_words or words)
+
+
+def search_cache_key(query: str) -> str:
+    return f'search:{hashlib.sha256(normalize_query(query).encode()).hexdigest()}'
+
+
 def fetch_sources(query: str) -> Dict[str, str]:
-    url = f'{os.environ["SERPER_URL"]}/search'
+    search_cache = caches['search']
+    cache_key = search_cache_key(query)
 
-    payload = json.dumps({
+    sources = search_cache.get(cache_key)
+    if sources is not None:
+        metrics.increment('search_cache_hit')
+        return sources
+    metrics.increment('search_cache_miss')
+
+    payload = {
         'q': f'what is {query} -site:youtube.com'
-    })
-    headers = {
-        'X-API-KEY': os.environ['SERPER_API_KEY'],
-        'Content-Type': 'application/json'
     }
 
-    response = requests.post(url, headers=headers, data=payload)
+    response = get_search_client().post('/search', json=payload)
 
     if response.status_code == 200:
-        return response.json()['organic'][:5]
+        sources = response.json()['organic'][:5]
+        if sources:
+            search_cache.set(cache_key, sources)
+        return sources
     return None
 
 
-def filter_text(text_content: str) -> str:
-    non_empty_lines = [line for line in text_content.splitlines() if line.strip()]
-    filtered_text = '\n'.join(non_empty_lines)
-    filtered_text = re.sub(r'(\n){4,}', '\n\n\n', filtered_text)
-    filtered_text = re.sub(r'\n\n', ' ', filtered_text)
-    filtered_text = re.sub(r' {3,}', '  ', filtered_text)
-    filtered_text = filtered_text.replace('\t', '')
-    filtered_text = re.sub(r'\n+(\s*\n)*', '\n', filtered_text)
-    filtered_text = filtered_text.replace('"', "'")
+# Boundaries recognised by str.splitlines().
+LINE_BREAKS_PATTERN = re.compile(r'\r\n|[\n\r\v\f\x1c\x1d\x1e\x85\u2028\u2029]')
+LINE_REPLACEMENTS_PATTERN = re.compile(r'( {3,})|(\t+)|"')
+
+
+def replace_in_line(match: re.Match) -> str:
+    if match.group(1):
+        return '  '
+    if match.group(2):
+        return ''
+    return "'"
+
+
+def iter_filtered_lines(text_content: str) -> Generator[str, None, None]:
+    """
+    Yield the non-blank lines of the text with long runs of spaces collapsed to two,
+    tabs removed and double quotes replaced, scanning the text lazily.
+    """
+    start = 0
+    for line_break in LINE_BREAKS_PATTERN.finditer(text_content):
+        line = text_content[start:line_break.start()]
+        start = line_break.end()
+        if line.strip():
+            yield LINE_REPLACEMENTS_PATTERN.sub(replace_in_line, line)
+
+    line = text_content[start:]
+    if line.strip():
+        yield LINE_REPLACEMENTS_PATTERN.sub(replace_in_line, line)
+
+
+def filter_text(text_content: str, max_length: int = 100000) -> str:
+    chunks, length = [], 0
+
+    for line in iter_filtered_lines(text_content):
+        if chunks:
+            chunks.append('\n')
+            length += 1
+        chunks.append(line)
+        length += len(line)
+
+        if length >= max_length:
+            break
+
+    return ''.join(chunks)[:max_length]
+
+
+def url_hash(url: str) -> str:
+    return hashlib.sha256(url.encode()).hexdigest()
+
+
+def fetch_source_page(source: Dict[str, str], cached_page: CachedPage | None = None) -> Dict[str, str]:
+    headers = {}
+    if cached_page:
+        if cached_page.etag:
+            headers['If-None-Match'] = cached_page.etag
+        if cached_page.last_modified:
+            headers['If-Modified-Since'] = cached_page.last_modified
+
+    response = get_pages_client().get(source.get('link'), headers=headers)
+    if cached_page and response.status_code == 304:
+        return {
+            'title': source.get('title'),
+            'url': source.get('link'),
+            'content': cached_page.content,
+            'cache_status': 'revalidated'
+        }
 
-    return filtered_text[:100000]
+    if response.status_code != 200:
+        raise ValueError(f'HTTP {response.status_code}')
+
+    text_content = extract_text(response.text)
+    filtered_text = filter_text(text_content)
+    if not filtered_text:
+        raise ValueError('no text content')
+
+    return {
+        'title': source.get('title'),
+        'url': source.get('link'),
+        'content': filtered_text,
+        'etag': response.headers.get('ETag', ''),
+        'last_modified': response.headers.get('Last-Modified', '')
+    }
+
+
+def store_cached_pages(pages: List[Dict[str, str]]):
+    """
+    Save freshly fetched pages to the page cache and refresh revalidated ones.
+    """
+    now = timezone.now()
+
+    for page in pages:
+        cache_status = page.pop('cache_status', None)
+        if cache_status == 'hit':
+            CachedPage.objects.filter(url_hash=url_hash(page['url'])).update(accessed_at=now)
+            continue
+        if cache_status == 'revalidated':
+            CachedPage.objects.filter(url_hash=url_hash(page['url'])).update(fetched_at=now, accessed_at=now)
+            continue
+
+        CachedPage.objects.update_or_create(url_hash=url_hash(page['url']), defaults={
+            'url': page['url'],
+            'content': page['content'],
+            'etag': page.pop('etag', '')[:255],
+            'last_modified': page.pop('last_modified', '')[:64],
+            'size': len(page['content'].encode()),
+            'fetched_at': now,
+            'accessed_at': now
+        })
+
+
+def evict_cached_pages():
+    """
+    Evict the least recently used pages once the page cache grows over PAGE_CACHE_MAX_BYTES.
+    """
+    total_size = CachedPage.objects.aggregate(total=Sum('size'))['total'] or 0
+    if total_size <= settings.PAGE_CACHE_MAX_BYTES:
+        return
+
+    evicted = []
+    for pk, size in CachedPage.objects.order_by('accessed_at').values_list('pk', 'size').iterator():
+        if total_size <= settings.PAGE_CACHE_MAX_BYTES:
+            break
+        evicted.append(pk)
+        total_size -= size
+
+    CachedPage.objects.filter(pk__in=evicted).delete()
+
+
+def fetch_source_pages(sources: List[Dict[str, str]]) -> Tuple[List[Dict[str, str]], List[Dict[str, str]]]:
+    """
+    Download and parse the given search results concurrently.
+
+    Pages cached within PAGE_CACHE_TTL are served without a request, stale ones are
+    revalidated with a conditional GET. Returns the parsed pages in search rank order
+    together with the sources that were dropped, each with the reason. Pages still
+    downloading when the overall deadline passes are dropped, so the total time is
+    bounded by SOURCES_FETCH_DEADLINE.
+    """
+    cached_pages = {page.url_hash: page for page in CachedPage.objects.filter(
+        url_hash__in=[url_hash(source.get('link')) for source in sources])}
+    fresh_after = timezone.now() - timedelta(seconds=settings.PAGE_CACHE_TTL)
+
+    executor = ThreadPoolExecutor(max_workers=settings.SOURCES_FETCH_WORKERS)
+    futures, cache_hits = [], 0
+    for source in sources:
+        cached_page = cached_pages.get(url_hash(source.get('link')))
+        if cached_page and cached_page.fetched_at >= fresh_after:
+            cache_hits += 1
+            future = Future()
+            future.set_result({'title': source.get('title'), 'url': source.get('link'),
+                               'content': cached_page.content, 'cache_status': 'hit'})
+        else:
+            future = executor.submit(fetch_source_page, source, cached_page)
+        futures.append(future)
+
+    if cache_hits:
+        metrics.increment('page_cache_hit', cache_hits)
+    if len(futures) - cache_hits:
+        metrics.increment('page_cache_miss', len(futures) - cache_hits)
+
+    wait(futures, timeout=settings.SOURCES_FETCH_DEADLINE)
+    executor.shutdown(wait=False, cancel_futures=True)
+
+    sources_data, dropped = [], []
+    for source, future in zip(sources, futures):
+        if not future.done():
+            reason = 'deadline exceeded'
+        elif future.cancelled():
+            reason = 'cancelled'
+        elif future.exception() is not None:
+            exception = future.exception()
+            reason = 'timeout' if isinstance(exception, requests.Timeout) else str(exception) or type(exception).__name__
+        else:
+            sources_data.append(future.result())
+            continue
+
+        dropped.append({'url': source.get('link'), 'reason': reason})
+
+    store_cached_pages(sources_data)
+
+    return sources_data, dropped
 
 
 def fetch_sources_parsed(query: str) -> Dict[str, str]:
     sources = fetch_sources(query)
-    sources_data = []
 
     if sources:
-        for source in sources:
-            response = requests.get(source.get('link'))
-            if response.status_code == 200:
-                text_content = BeautifulSoup(response.text, 'html.parser').get_text()
-                filtered_text = filter_text(text_content)
-
-                sources_data.append({
-                    'title': source.get('title'),
-                    'url': source.get('link'),
-                    'content': filtered_text
-                })
-        
+        started_at = time.monotonic()
+        sources_data, dropped = fetch_source_pages(sources)
+
+        for source in dropped:
+            logger.warning('Dropped source %s for query %r: %s', source['url'], query, source['reason'])
+        logger.info('Fetched %d of %d sources for query %r in %.2fs', len(sources_data), len(sources),
+                    query, time.monotonic() - started_at)
+
         if sources_data:
             return sources_data
-            
+
     return None
 
 
@@ -156,13 +360,38 @@ def get_system_prompt(sources_data: Dict[str, str], hours: int, topic: str) -> s
         'It is crucial that you adhere strictly to these instructions as they are essential for my career development.'
     )
 
+    packed_sources, stats = pack_context(sources_data, normalize_query(topic).split(),
+                                         token_budget=settings.CONTEXT_TOKEN_BUDGET)
+    saved_tokens = stats['total_tokens'] - stats['packed_tokens']
+    logger.info('Packed %d of %d source tokens for topic %r, saved %d tokens', stats['packed_tokens'],
+                stats['total_tokens'], topic, saved_tokens)
+    metrics.increment('context_tokens_saved', saved_tokens)
+
     teaching_info = '\n\n<teaching_info>\n'
-    for index, source in enumerate(sources_data):
-        teaching_info += f"## Webpage #{index}: \n{source.get('content')}\n\n"
-    
+    for index, passages in enumerate(filter(None, packed_sources)):
+        passages_text = '\n'.join(passages)
+        teaching_info += f"## Webpage #{index}: \n{passages_text}\n\n"
+
     teaching_info += '</teaching_info>'
 
     prompt_details = f'The number of hours to study this theme is specified as: <hours>{hours}</hours>.\n\n'
     prompt_details += f'The topic to study is: {topic}'
 
     return f'{prompt_base}{teaching_info}{prompt_details}'.replace('"', "'")
+
+
+def get_grounding_prompt(chat_session: ChatSession, topic: str) -> str:
+    """
+    Passages of the session sources most relevant to the topic, used to ground generation
+    requests that run outside of the chat history.
+    """
+    sources = list(chat_session.sources.values(content=F('body__text')))
+    packed_sources, _ = pack_context(sources, normalize_query(topic).split(),
+                                     token_budget=settings.GROUNDING_TOKEN_BUDGET)
+
+    teaching_info = '<teaching_info>\n'
+    for index, passages in enumerate(filter(None, packed_sources)):
+        passages_text = '\n'.join(passages)
+        teaching_info += f"## Webpage #{index}: \n{passages_text}\n\n"
+
+    return f'{teaching_info}</teaching_info>'.replace('"', "'")
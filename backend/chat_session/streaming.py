@@ -0,0 +1,97 @@
+import asyncio
+from typing import AsyncGenerator, AsyncIterator
+
+import orjson
+
+
+class UpstreamStreamError(Exception):
+    """
+    Raised when the LLM provider reports an error inside an already started stream.
+    """
+
+
+async def iter_deltas(lines: AsyncIterator[str]) -> AsyncGenerator[str, None]:
+    """
+    Parse the server-sent events of a streamed completion into text deltas.
+
+    Stops at the `[DONE]` sentinel and raises UpstreamStreamError on error events.
+    """
+    async for line in lines:
+        if not line or line.startswith(':'):
+            continue
+        if line.startswith('data:'):
+            line = line[len('data:'):].lstrip()
+        if line == '[DONE]':
+            return
+
+        try:
+            event = orjson.loads(line)
+        except orjson.JSONDecodeError:
+            raise UpstreamStreamError(f'Malformed stream event: {line[:200]}')
+
+        if event.get('error'):
+            error = event['error']
+            raise UpstreamStreamError(error.get('message', str(error)) if isinstance(error, dict) else str(error))
+
+        choices = event.get('choices') or [{}]
+        delta = choices[0].get('text') or (choices[0].get('delta') or {}).get('content')
+        if delta:
+            yield delta
+
+
+async def coalesce_deltas(deltas: AsyncIterator[str], max_delay: float, max_bytes: int) -> AsyncGenerator[str, None]:
+    """
+    Merge deltas into chunks, emitting a chunk once the oldest buffered delta waited
+    `max_delay` seconds or the buffer reached `max_bytes`, whichever comes first.
+    """
+    loop = asyncio.get_running_loop()
+    iterator = deltas.__aiter__()
+    buffer, buffered_bytes, flush_at = [], 0, None
+    next_delta = asyncio.ensure_future(iterator.__anext__())
+
+    try:
+        while True:
+            timeout = None if flush_at is None else max(flush_at - loop.time(), 0)
+            done, _ = await asyncio.wait({next_delta}, timeout=timeout)
+            if not done:
+                yield ''.join(buffer)
+                buffer, buffered_bytes, flush_at = [], 0, None
+                continue
+
+            try:
+                delta = next_delta.result()
+            except StopAsyncIteration:
+                break
+            except Exception:
+                if buffer:
+                    yield ''.join(buffer)
+                raise
+
+            buffer.append(delta)
+            buffered_bytes += len(delta.encode())
+            if flush_at is None:
+                flush_at = loop.time() + max_delay
+            if buffered_bytes >= max_bytes:
+                yield ''.join(buffer)
+                buffer, buffered_bytes, flush_at = [], 0, None
+
+            next_delta = asyncio.ensure_future(iterator.__anext__())
+
+        if buffer:
+            yield ''.join(buffer)
+    finally:
+        if not next_delta.done():
+            next_delta.cancel()
+
+
+def format_event(data: str | None, event: str | None = None, event_id: str | None = None) -> str:
+    frame = ''
+    if event_id:
+        frame += f'id: {event_id}\n'
+    if event:
+        frame += f'event: {event}\n'
+    if data is not None:
+        # Line breaks are escaped so that every frame stays a single `data:` line.
+        processed_data = data.replace('\n', '\\n')
+        frame += f'data: {processed_data}\n'
+    return f'{frame}\n'
@@ -1,3 +1,264 @@
-from django.test import TestCase
+import asyncio
+import random
+import re
+from unittest import mock
 
-# Create your tests here.
+import httpx
+
+from django.core.cache import cache
+from django.test import AsyncClient, SimpleTestCase, TestCase, override_settings
+from rest_framework.test import APIClient
+from rest_framework.throttling import UserRateThrottle
+from rest_framework_simplejwt.tokens import AccessToken
+
+from account.models import Account
+from chat_session.client import AsyncUpstreamClient
+from chat_session.models import ChatSession, ChatSource, ChatMessage
+from chat_session.serializers import ChatSessionSerializer
+from chat_session.services import filter_text
+
+
+def create_chat_session(user, sources: int = 3, exchanges: int = 10) -> ChatSession:
+    """
+    A session with sources, a system prompt and `exchanges` user messages with their replies.
+    """
+    chat_session = ChatSession.objects.create(user=user, summary='Summary of the conversation.')
+    for index in range(sources):
+        source = ChatSource(chat_session=chat_session, title=f'Source {index}', url=f'https://example.com/{index}')
+        source.content = f'Text of source {index}.'
+        source.save()
+
+    system = ChatMessage(chat_session=chat_session, role='system')
+    system.text = 'System prompt.'
+    system.save()
+    for index in range(exchanges):
+        ChatMessage.objects.create(chat_session=chat_session, role='user', content=f'Question {index}?')
+        ChatMessage.objects.create(chat_session=chat_session, role='assistant', content=f'Answer {index}.')
+
+    return chat_session
+
+
+class ReadQueriesTests(TestCase):
+    """
+    The read endpoints run a fixed number of queries, however long the conversations are.
+    """
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = Account.objects.create_user('reader@example.com', 'password', username='reader')
+        cls.chat_sessions = [create_chat_session(cls.user), create_chat_session(cls.user, sources=8, exchanges=80)]
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.user, token='token')
+
+    def test_list(self):
+        with self.assertNumQueries(1):
+            response = self.client.get('/chats/')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(sorted(session['messages_count'] for session in response.data), [10, 80])
+
+    def test_retrieve(self):
+        for chat_session in self.chat_sessions:
+            with self.assertNumQueries(2):
+                response = self.client.get(f'/chats/{chat_session.pk}/')
+
+            self.assertEqual(response.status_code, 200)
+
+    def test_messages(self):
+        chat_session = self.chat_sessions[1]
+        with self.assertNumQueries(2):
+            response = self.client.get(f'/chats/{chat_session.pk}/messages/')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data['results']), 50)
+
+        with self.assertNumQueries(2):
+            response = self.client.get(response.data['next'])
+
+        self.assertEqual(len(response.data['results']), 50)
+
+
+class MessagesPaginationTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = Account.objects.create_user('reader@example.com', 'password', username='reader')
+        cls.chat_session = create_chat_session(cls.user, sources=0, exchanges=7)
+        # An assistant message that follows another one, like the generated plan, is not part of the conversation.
+        ChatMessage.objects.create(chat_session=cls.chat_session, role='assistant', content='Plan.')
+        for index in range(7, 10):
+            ChatMessage.objects.create(chat_session=cls.chat_session, role='user', content=f'Question {index}?')
+            ChatMessage.objects.create(chat_session=cls.chat_session, role='assistant', content=f'Answer {index}.')
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.user, token='token')
+
+    def get_page(self, url: str):
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return [message['content'] for message in response.data['results']], response.data
+
+    def test_cursors_keep_replies_at_page_boundaries(self):
+        expected = [text for index in reversed(range(10)) for text in (f'Answer {index}.', f'Question {index}?')]
+
+        # Pages of 3 split every other exchange between two pages.
+        page, data = self.get_page(f'/chats/{self.chat_session.pk}/messages/?page_size=3')
+        pages = [page]
+        while data['next']:
+            page, data = self.get_page(data['next'])
+            pages.append(page)
+        self.assertEqual(pages, [expected[index:index + 3] for index in range(0, len(expected), 3)])
+
+        previous_pages = []
+        while data['previous']:
+            page, data = self.get_page(data['previous'])
+            previous_pages.append(page)
+        self.assertEqual(previous_pages, pages[-2::-1])
+
+
+class ChatSessionSerializerTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = Account.objects.create_user('writer@example.com', 'password', username='writer')
+
+    def session_data(self, content: str):
+        return {
+            'user': self.user.id,
+            'sources': [{'title': 'Source', 'url': 'https://example.com/', 'content': content}],
+            'messages': [{'role': 'system', 'content': 'System prompt.'}]
+        }
+
+    def test_blank_source_content(self):
+        serializer = ChatSessionSerializer(data=self.session_data(''))
+        self.assertFalse(serializer.is_valid())
+        self.assertIn('content', serializer.errors['sources'][0])
+
+        # Only pages fetched by the server may have parsed to no text.
+        serializer = ChatSessionSerializer(data=self.session_data(''), context={'fetched_sources': True})
+        self.assertTrue(serializer.is_valid(), serializer.errors)
+        chat_session = serializer.save()
+        self.assertIsNone(chat_session.sources.get().body_id)
+
+
+@mock.patch.object(UserRateThrottle, 'THROTTLE_RATES', {'user': '2/min'})
+class StreamThrottleTests(TestCase):
+    """
+    The streaming views share the user rate of the API views.
+    """
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = Account.objects.create_user('streamer@example.com', 'password', username='streamer')
+
+    def setUp(self):
+        cache.clear()
+        self.client = AsyncClient()
+        self.headers = {'Authorization': f'Bearer {AccessToken.for_user(self.user)}'}
+
+    async def test_rate(self):
+        missing = '00000000-0000-0000-0000-000000000000'
+        requests = [
+            lambda: self.client.post(f'/chats/{missing}/send_message/', {'message': 'Hello?'},
+                                     content_type='application/json', headers=self.headers),
+            lambda: self.client.get(f'/jobs/{missing}/progress/', headers=self.headers),
+        ]
+        for request in requests:
+            cache.clear()
+            responses = [await request() for _ in range(3)]
+
+            self.assertEqual([response.status_code for response in responses], [404, 404, 429])
+            self.assertTrue(0 < int(responses[-1]['Retry-After']) <= 60)
+
+
+@override_settings(CORS_ALLOWED_ORIGINS=['https://app.example.com'])
+class StreamResumeCorsTests(SimpleTestCase):
+    def test_preflight_allows_last_event_id(self):
+        response = self.client.options('/chats/00000000-0000-0000-0000-000000000000/send_message/',
+                                       HTTP_ORIGIN='https://app.example.com',
+                                       HTTP_ACCESS_CONTROL_REQUEST_METHOD='POST',
+                                       HTTP_ACCESS_CONTROL_REQUEST_HEADERS='authorization, content-type, last-event-id')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Access-Control-Allow-Origin'], 'https://app.example.com')
+        self.assertIn('last-event-id', response['Access-Control-Allow-Headers'].split(', '))
+
+
+@override_settings(UPSTREAM_RETRY_AFTER_MAX=30, UPSTREAM_BACKOFF_FACTOR=0.5, UPSTREAM_BACKOFF_JITTER=0)
+class AsyncRetryAfterTests(SimpleTestCase):
+    def test_retry_delay(self):
+        cases = [
+            (429, {'Retry-After': '2'}, 2),
+            (503, {'Retry-After': '600'}, 30),
+            (429, {'Retry-After': 'Thu, 01 Jan 1970 00:00:00 GMT'}, 1),
+            (429, {'Retry-After': 'soon'}, 1),
+            (429, {}, 1),
+            (500, {'Retry-After': '2'}, 1),
+        ]
+        for status, headers, delay in cases:
+            with self.subTest(status=status, headers=headers):
+                self.assertEqual(AsyncUpstreamClient.retry_delay(httpx.Response(status, headers=headers), 1), delay)
+
+    def test_stream_waits_for_retry_after(self):
+        responses = iter([httpx.Response(429, headers={'Retry-After': '3'}), httpx.Response(200, text='data: [DONE]')])
+        delays = []
+
+        async def sleep(delay):
+            delays.append(delay)
+
+        async def run():
+            client = AsyncUpstreamClient('LLM provider', base_url='https://llm.example.com', idempotent=False)
+            client.client = httpx.AsyncClient(base_url='https://llm.example.com',
+                                              transport=httpx.MockTransport(lambda request: next(responses)))
+            async with client.stream('POST', '/v1/chat/completions', json={}) as response:
+                return response.status_code
+
+        with mock.patch('chat_session.client.asyncio.sleep', sleep):
+            self.assertEqual(asyncio.run(run()), 200)
+        self.assertEqual(delays, [3])
+
+
+def reference_filter_text(text_content: str, max_length: int = 100000) -> str:
+    # The whole-text implementation filter_text replaced, which it must match.
+    non_empty_lines = [line for line in text_content.splitlines() if line.strip()]
+    filtered_text = '\n'.join(non_empty_lines)
+    filtered_text = re.sub(r'(\n){4,}', '\n\n\n', filtered_text)
+    filtered_text = re.sub(r'\n\n', ' ', filtered_text)
+    filtered_text = re.sub(r' {3,}', '  ', filtered_text)
+    filtered_text = filtered_text.replace('\t', '')
+    filtered_text = re.sub(r'\n+(\s*\n)*', '\n', filtered_text)
+    filtered_text = filtered_text.replace('"', "'")
+
+    return filtered_text[:max_length]
+
+
+class FilterTextTests(SimpleTestCase):
+    CASES = {
+        'empty': '',
+        'whitespace only': ' \t \n\r\n \x0b\x0c \u2028 \n\t',
+        'single line': 'Plain text.',
+        'quotes': 'He said "hello" and \'bye\'.',
+        'tabs and spaces': 'a\t \t  b    c \t\t   d',
+        'line breaks': 'one\r\ntwo\rthree\x0bfour\x0cfive\x1csix\x1dseven\x1eeight\x85nine\u2028ten\u2029eleven',
+        'blank lines': '\n\n\nfirst\n\n\n\n\n  \n\t\nsecond\n\n',
+        'unicode': 'Zürich “quoted” 東京\u00a0\u00a0\u00a0text\n\u3000\n\U0001f600 emoji\u200b',
+        'long runs of spaces': 'a' + ' ' * 50000 + 'b',
+        'long runs of tabs': 'a' + '\t' * 50000 + 'b',
+        'long runs of line breaks': 'a' + '\n' * 50000 + 'b' + '\r\n' * 50000,
+        'long runs of quotes': '"' * 120000,
+        'long lines': '\n'.join(f'Line {index} ' + 'word ' * 500 for index in range(100)),
+    }
+
+    def test_matches_reference(self):
+        for name, text in self.CASES.items():
+            for max_length in (0, 1, 7, 100, 100000):
+                with self.subTest(name, max_length=max_length):
+                    self.assertEqual(filter_text(text, max_length), reference_filter_text(text, max_length))
+
+    def test_matches_reference_on_random_text(self):
+        alphabet = 'ab "\t\t   \n\n\r\x0b\x85\u2028\u00a0é東'
+        generator = random.Random(0)
+        for _ in range(2000):
+            text = ''.join(generator.choices(alphabet, k=generator.randint(0, 80)))
+            max_length = generator.randint(0, 100)
+            with self.subTest(text=text, max_length=max_length):
+                self.assertEqual(filter_text(text, max_length), reference_filter_text(text, max_length))
@@ -1,12 +1,13 @@
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
 
-from chat_session.views import ChatSessionViewSet
+from chat_session.views import ChatSessionViewSet, send_message
 
 
 router = DefaultRouter()
 router.register(r'', ChatSessionViewSet, basename='')
 
 urlpatterns = [
+    path('<str:pk>/send_message/', send_message, name='chat_session_send_message'),
     path('', include(router.urls))
 ]
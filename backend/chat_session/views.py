@@ -1,16 +1,37 @@
+import json
+
+from asgiref.sync import sync_to_async
+from django.core.exceptions import ValidationError
 from django.shortcuts import get_object_or_404
-from django.http import StreamingHttpResponse
-from django.db import transaction
+from django.core.handlers.asgi import ASGIRequest
+from django.http import Http404, HttpRequest, JsonResponse, StreamingHttpResponse
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_POST
 from rest_framework.viewsets import ViewSet
+from rest_framework.decorators import action
+from rest_framework.pagination import CursorPagination
 from rest_framework.response import Response
 from rest_framework import status
-from rest_framework.decorators import action
+from rest_framework.exceptions import AuthenticationFailed, Throttled
+from rest_framework.throttling import UserRateThrottle
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import InvalidToken
 
 from account.permissions import IsAuthenticated
+from study_helper.query_budget import query_budget
 from chat_session.services import fetch_sources_parsed, get_system_prompt
-from chat_session.models import ChatMessage
-from chat_session.serializers import ChatSessionSerializer
-from chat_session.services import get_llama_response_stream
+from chat_session.models import ChatSession, ChatMessage
+from chat_session.serializers import ChatSessionSerializer, ChatSessionSummarySerializer, ChatHistoryMessageSerializer
+from chat_session.generations import start_generation, stream_reply_events
+from job.services import cancel_queued_jobs
+
+
+class ChatMessagePagination(CursorPagination):
+    # Newest first, earlier pages of a long conversation are fetched with the `next` cursor.
+    ordering = '-id'
+    page_size = 50
+    max_page_size = 200
+    page_size_query_param = 'page_size'
 
 
 class ChatSessionViewSet(ViewSet):
@@ -23,23 +44,41 @@ class ChatSessionViewSet(ViewSet):
     def get_object(self, pk):
         return get_object_or_404(self.get_queryset(), pk=pk)
     
+    @query_budget(2)
     def retrieve(self, request, pk=None, *args, **kwargs):
         """
         Retrieve a ChatSession instance identified by its primary key.
         """
-        chat_session = self.get_object(pk)
+        chat_session = get_object_or_404(self.get_queryset().defer('summary'), pk=pk)
         serializer = self.serializer_class(chat_session)
 
         return Response(serializer.data, status=status.HTTP_200_OK)
 
+    @query_budget(1)
     def list(self, request, *args, **kwargs):
         """
-        Get a list of all the ChatSessions that belong to the current user.
+        Get a summary of all the ChatSessions that belong to the current user.
         """
-        serializer = self.serializer_class(self.get_queryset(), many=True)
+        serializer = ChatSessionSummarySerializer(self.get_queryset().summaries().order_by('-created_at'), many=True)
 
         return Response(serializer.data, status=status.HTTP_200_OK)
 
+    @action(detail=True, methods=['get'])
+    @query_budget(2)
+    def messages(self, request, pk=None, *args, **kwargs):
+        """
+        Get the conversation of a ChatSession identified by its primary key, newest messages
+        first, in pages navigated with the `next` and `previous` cursors.
+        """
+        chat_session = get_object_or_404(self.get_queryset().only('id', 'user_id'), pk=pk)
+        messages = chat_session.messages.conversation()
+
+        paginator = ChatMessagePagination()
+        page = paginator.paginate_queryset(messages, request, view=self)
+        serializer = ChatHistoryMessageSerializer(page, many=True)
+
+        return paginator.get_paginated_response(serializer.data)
+
     def create(self, request, *args, **kwargs):
         """
         Create a new ChatSession instance.
@@ -84,7 +123,7 @@ class ChatSessionViewSet(ViewSet):
             'user': request.user.id,
             'sources': sources_data,
             'messages': [{'role': 'system', 'content': message_data}]
-        })
+        }, context={'fetched_sources': True})
 
         serializer.is_valid(raise_exception=True)
         serializer.save()
@@ -98,35 +137,101 @@ class ChatSessionViewSet(ViewSet):
         chat_session = self.get_object(pk)
         chat_session.is_active = False
         chat_session.save()
+        # Subtopic content prefetched for the plan of this session is no longer needed.
+        cancel_queued_jobs(kind='prefetch_subtopic_content', payload__session=str(chat_session.id))
 
         return Response({
             'status': 'ok'
         }, status=status.HTTP_200_OK)
-    
-    @action(detail=True, methods=['post'])
-    def send_message(self, request, pk=None, *args, **kwargs):
-        """
-        Send a message to the Llama and receive a response.
-        """
-        chat_session = self.get_object(pk)
-        message = request.data.get('message')
 
-        if not message:
-            return Response({'details': f"The message parameter is required but was not provided."}, 
-                            status=status.HTTP_400_BAD_REQUEST)
-        
-        if chat_session.messages.filter(role = "user").count() >= 20:
-            return Response({'details': ('You have reached the maximum allowed limit of 20 messages per session.')}, 
-                            status=status.HTTP_403_FORBIDDEN)
 
+async def authenticate(request: HttpRequest):
+    try:
+        authenticated = await sync_to_async(JWTAuthentication().authenticate)(request)
+    except (AuthenticationFailed, InvalidToken):
+        return None
+    return authenticated[0] if authenticated else None
+
+
+async def throttle(request: HttpRequest, user) -> JsonResponse | None:
+    """
+    Apply the user rate of the API views, which plain async views don't go through.
+    Returns the 429 response once the user is over it.
+    """
+    user_throttle = UserRateThrottle()
+    # UserRateThrottle keys the rate on request.user, as DRF views set it.
+    request.user = user
+    if await sync_to_async(user_throttle.allow_request)(request, None):
+        return None
+
+    exception = Throttled(user_throttle.wait())
+    response = JsonResponse({'detail': exception.detail}, status=exception.status_code)
+    if exception.wait:
+        response['Retry-After'] = str(exception.wait)
+    return response
+
+
+@csrf_exempt
+@require_POST
+async def send_message(request: HttpRequest, pk: str):
+    """
+    Send a message to the Llama and stream the response as server-sent events.
+
+    Served as a plain async view, so an open stream only holds an event loop task
+    instead of a worker thread. A request with the Last-Event-ID header resumes the
+    reply it identifies instead of sending a new message.
+    """
+    if not isinstance(request, ASGIRequest):
+        # Under WSGI the view runs on a temporary event loop, which cancels the generation task
+        # as soon as the view returns.
+        return JsonResponse({'details': 'Streaming replies require the ASGI server.'},
+                            status=status.HTTP_501_NOT_IMPLEMENTED)
+
+    user = await authenticate(request)
+    if user is None:
+        return JsonResponse({'detail': 'Authentication credentials were not provided.'},
+                            status=status.HTTP_401_UNAUTHORIZED)
+
+    throttled = await throttle(request, user)
+    if throttled is not None:
+        return throttled
+
+    try:
+        chat_session = await user.chatsession_set.filter(is_active=True).aget(pk=pk)
+    except (ChatSession.DoesNotExist, ValidationError):
+        raise Http404
+
+    last_event_id = request.headers.get('Last-Event-ID')
+    if last_event_id:
         try:
-            with transaction.atomic():
-                ChatMessage.objects.create(chat_session=chat_session, role='user', content=message)
-                response = StreamingHttpResponse(get_llama_response_stream(chat_session=chat_session))
-                response['Content-Type'] = 'text/event-stream'
+            message_id, offset = map(int, last_event_id.split(':'))
+        except ValueError:
+            return JsonResponse({'details': 'The Last-Event-ID header is malformed.'},
+                                status=status.HTTP_400_BAD_REQUEST)
 
-        except Exception as e:
-            return Response({'details': f'An unexpected error occurred while fetching response: {str(e)}'}, 
-                            status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+        if not await chat_session.messages.filter(pk=message_id, role='assistant').aexists():
+            raise Http404
 
+        response = StreamingHttpResponse(stream_reply_events(message_id, offset))
+        response['Content-Type'] = 'text/event-stream'
         return response
+
+    try:
+        message = json.loads(request.body or '{}').get('message')
+    except (json.JSONDecodeError, AttributeError):
+        message = None
+
+    if not message:
+        return JsonResponse({'details': f"The message parameter is required but was not provided."},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+    if await chat_session.messages.filter(role = "user").acount() >= 20:
+        return JsonResponse({'details': ('You have reached the maximum allowed limit of 20 messages per session.')},
+                            status=status.HTTP_403_FORBIDDEN)
+
+    await ChatMessage.objects.acreate(chat_session=chat_session, role='user', content=message)
+    generation = await start_generation(chat_session)
+    response = StreamingHttpResponse(stream_reply_events(generation.message.pk))
+    response['Content-Type'] = 'text/event-stream'
+
+    return response
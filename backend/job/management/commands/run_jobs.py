@@ -0,0 +1,42 @@
+import time
+import signal
+
+from django.conf import settings
+from django.db import close_old_connections
+from django.core.management.base import BaseCommand
+
+from job.services import claim_job, run_job, run_periodic_tasks
+
+
+class Command(BaseCommand):
+    help = ('Run queued background jobs. Workers claim jobs with SKIP LOCKED, '
+            'so any number of them can run side by side.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--burst', action='store_true', help='Exit once no job is due instead of waiting for more.')
+
+    def handle(self, *args, **options):
+        self.stopping = False
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+
+        last_runs = {}
+        while not self.stopping:
+            close_old_connections()
+            run_periodic_tasks(last_runs)
+
+            job = claim_job()
+            if job is None:
+                if options['burst']:
+                    break
+                time.sleep(settings.JOB_POLL_INTERVAL)
+                continue
+
+            self.stdout.write(f'Running {job}, attempt {job.attempts} of {job.max_attempts}')
+            run_job(job)
+            self.stdout.write(f'Finished {job}')
+
+    def stop(self, signum, frame):
+        # The job in progress is finished before exiting, its lock would otherwise wait for JOB_STALE_TIMEOUT.
+        self.stdout.write('Stopping after the current job.')
+        self.stopping = True
@@ -0,0 +1,11 @@
+from rest_framework import serializers
+
+from job.models import Job
+
+
+class JobSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = Job
+        fields = ['id', 'kind', 'status', 'progress', 'progress_message', 'result', 'error',
+                  'attempts', 'max_attempts', 'created_at', 'finished_at']
+        read_only_fields = fields
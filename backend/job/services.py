@@ -0,0 +1,201 @@
+import json
+import time
+import random
+import asyncio
+import logging
+from datetime import timedelta
+from typing import Any, AsyncGenerator, Callable, Dict
+
+from django.conf import settings
+from django.db import IntegrityError, connection, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from chat_session.streaming import format_event
+from job.models import Job
+from job.serializers import JobSerializer
+
+
+logger = logging.getLogger(__name__)
+
+# Job handlers by kind, registered by the apps that define them.
+handlers: Dict[str, Callable[[Job], Any]] = {}
+# Maintenance tasks with the seconds between two of their runs, registered by the apps that define them.
+periodic_tasks: Dict[Callable[[], Any], float] = {}
+
+
+def register(kind: str):
+    """
+    Register the decorated function as the handler of `kind` jobs. The handler gets the
+    running Job and returns its JSON-serializable result.
+    """
+    def decorator(handler: Callable[[Job], Any]):
+        handlers[kind] = handler
+        return handler
+    return decorator
+
+
+def periodic(interval: float):
+    """
+    Run the decorated function every `interval` seconds in every job worker, starting when
+    the worker starts. Several workers run it side by side, so it has to be idempotent.
+    """
+    def decorator(task: Callable[[], Any]):
+        periodic_tasks[task] = interval
+        return task
+    return decorator
+
+
+def run_periodic_tasks(last_runs: Dict[Callable[[], Any], float]):
+    """
+    Run the periodic tasks that are due, `last_runs` keeps the monotonic time of their last run.
+    """
+    for task, interval in periodic_tasks.items():
+        if task in last_runs and time.monotonic() - last_runs[task] < interval:
+            continue
+        last_runs[task] = time.monotonic()
+
+        try:
+            task()
+        except Exception:
+            logger.exception('Periodic task %s failed.', task.__qualname__)
+
+
+def enqueue(user, kind: str, payload: Dict[str, Any] | None = None, dedupe_key: str = '') -> Job:
+    """
+    Queue a job. With a `dedupe_key`, the queued or running job with the same key is
+    returned instead when there is one, so concurrent callers share a single run.
+    """
+    if kind not in handlers:
+        raise ValueError(f'Unknown job kind: {kind}')
+
+    while True:
+        try:
+            with transaction.atomic():
+                return Job.objects.create(user=user, kind=kind, payload=payload or {}, dedupe_key=dedupe_key,
+                                          max_attempts=settings.JOB_MAX_ATTEMPTS)
+        except IntegrityError:
+            if not dedupe_key:
+                raise
+
+        job = Job.objects.filter(dedupe_key=dedupe_key, status__in=Job.ACTIVE_STATUSES).first()
+        # Otherwise the active job finished in the meantime and a new one can be queued.
+        if job is not None:
+            return job
+
+
+def report_progress(job: Job, progress: int, message: str = ''):
+    job.progress, job.progress_message = progress, message
+    Job.objects.filter(pk=job.pk).update(progress=progress, progress_message=message, updated_at=timezone.now())
+
+
+def lock_job_kinds(kinds) -> None:
+    """
+    Hold advisory locks on the given job kinds until the end of the transaction. Only
+    Postgres has them, other databases serialize their write transactions anyway.
+    """
+    if connection.vendor != 'postgresql':
+        return
+
+    with connection.cursor() as cursor:
+        # In a fixed order, so that two workers can't each wait for a lock the other holds.
+        for kind in sorted(kinds):
+            cursor.execute('SELECT pg_advisory_xact_lock(hashtext(%s))', [f'job_kind:{kind}'])
+
+
+def claim_job() -> Job | None:
+    """
+    Mark the next due job as running and return it. SKIP LOCKED lets concurrent workers
+    claim different jobs without waiting for each other's transactions.
+    """
+    with transaction.atomic():
+        # Kinds with a concurrency limit are skipped while that many of them are running. Their locks
+        # are held until the claim commits, so a concurrent worker counts the job claimed here.
+        lock_job_kinds(settings.JOB_KIND_CONCURRENCY)
+        busy_kinds = [kind for kind, limit in settings.JOB_KIND_CONCURRENCY.items()
+                      if Job.objects.filter(kind=kind, status=Job.STATUS_RUNNING).count() >= limit]
+
+        job = (Job.objects.select_for_update(skip_locked=True)
+               .filter(status=Job.STATUS_QUEUED, run_after__lte=timezone.now())
+               .exclude(kind__in=busy_kinds)
+               .order_by('run_after')
+               .first())
+        if job is None:
+            return None
+
+        job.status = Job.STATUS_RUNNING
+        job.attempts += 1
+        job.locked_at = timezone.now()
+        job.save(update_fields=['status', 'attempts', 'locked_at', 'updated_at'])
+
+    return job
+
+
+def cancel_queued_jobs(**filters) -> int:
+    now = timezone.now()
+    return Job.objects.filter(status=Job.STATUS_QUEUED, **filters).update(status=Job.STATUS_CANCELLED,
+                                                                          finished_at=now, updated_at=now)
+
+
+@periodic(settings.JOB_STALE_TIMEOUT)
+def requeue_stale_jobs():
+    """
+    Requeue the jobs whose worker died while running them, or fail them if it was their last attempt.
+    """
+    now = timezone.now()
+    stale = Job.objects.filter(status=Job.STATUS_RUNNING,
+                               locked_at__lt=now - timedelta(seconds=settings.JOB_STALE_TIMEOUT))
+
+    stale.filter(attempts__lt=F('max_attempts')).update(status=Job.STATUS_QUEUED, locked_at=None,
+                                                               run_after=now, updated_at=now)
+    stale.update(status=Job.STATUS_FAILED, error='The worker running the job stopped.',
+                 locked_at=None, finished_at=now, updated_at=now)
+
+
+def run_job(job: Job):
+    """
+    Run a claimed job, retrying failures with jittered exponential backoff until
+    its attempts are exhausted.
+    """
+    handler = handlers.get(job.kind)
+    job.locked_at = None
+
+    try:
+        if handler is None:
+            raise ValueError(f'Unknown job kind: {job.kind}')
+        job.result = handler(job)
+    except Exception as e:
+        logger.exception('Attempt %s of %s failed.', job.attempts, job)
+        job.error = str(e)
+        if job.is_last_attempt:
+            job.status = Job.STATUS_FAILED
+            job.finished_at = timezone.now()
+        else:
+            job.status = Job.STATUS_QUEUED
+            job.run_after = timezone.now() + timedelta(seconds=settings.JOB_RETRY_BACKOFF * 2 ** (job.attempts - 1)
+                                                       + random.uniform(0, settings.JOB_RETRY_BACKOFF))
+    else:
+        job.status = Job.STATUS_SUCCEEDED
+        job.progress = 100
+        job.error = ''
+        job.finished_at = timezone.now()
+
+    job.save(update_fields=['status', 'progress', 'result', 'error', 'run_after',
+                            'locked_at', 'finished_at', 'updated_at'])
+
+
+async def stream_job_progress(job_id: str) -> AsyncGenerator[str, None]:
+    """
+    Server-sent events with the job state whenever it changes, until the job finishes.
+    """
+    last_state = None
+    while True:
+        job = await Job.objects.aget(pk=job_id)
+        state = (job.status, job.attempts, job.progress, job.progress_message)
+        if state != last_state:
+            yield format_event(json.dumps(JobSerializer(job).data))
+            last_state = state
+
+        if job.status in Job.FINISHED_STATUSES:
+            return
+        await asyncio.sleep(settings.JOB_PROGRESS_POLL_INTERVAL)
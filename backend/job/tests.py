@@ -0,0 +1,57 @@
+import threading
+from unittest import skipUnless
+
+from django.db import connection
+from django.test import TestCase, TransactionTestCase, override_settings
+
+from account.models import Account
+from job.models import Job
+from job.services import claim_job
+
+
+def queue_jobs(user, kind: str, count: int):
+    Job.objects.bulk_create([Job(user=user, kind=kind) for _ in range(count)])
+
+
+@override_settings(JOB_KIND_CONCURRENCY={'limited': 2})
+class ClaimJobTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = Account.objects.create_user('worker@example.com', 'password', username='worker')
+
+    def test_kind_concurrency(self):
+        queue_jobs(self.user, 'limited', 3)
+        queue_jobs(self.user, 'other', 1)
+
+        kinds = [claim_job().kind for _ in range(3)]
+
+        self.assertEqual(sorted(kinds), ['limited', 'limited', 'other'])
+        self.assertIsNone(claim_job())
+
+
+@skipUnless(connection.vendor == 'postgresql', 'Advisory locks are specific to Postgres.')
+@override_settings(JOB_KIND_CONCURRENCY={'limited': 2})
+class ConcurrentClaimJobTests(TransactionTestCase):
+    def test_kind_concurrency(self):
+        user = Account.objects.create_user('worker@example.com', 'password', username='worker')
+        queue_jobs(user, 'limited', 8)
+        barrier = threading.Barrier(8)
+        claimed = []
+
+        def work():
+            try:
+                barrier.wait()
+                job = claim_job()
+                if job is not None:
+                    claimed.append(job)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=work) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(len(claimed), 2)
+        self.assertEqual(Job.objects.filter(status=Job.STATUS_RUNNING).count(), 2)
@@ -0,0 +1,13 @@
+from django.urls import path, include
+from rest_framework.routers import DefaultRouter
+
+from job.views import JobViewSet, job_progress
+
+
+router = DefaultRouter()
+router.register(r'', JobViewSet, basename='')
+
+urlpatterns = [
+    path('<str:pk>/progress/', job_progress, name='job_progress'),
+    path('', include(router.urls))
+]
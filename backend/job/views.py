@@ -0,0 +1,62 @@
+from django.core.exceptions import ValidationError
+from django.shortcuts import get_object_or_404
+from django.http import Http404, HttpRequest, JsonResponse, StreamingHttpResponse
+from django.views.decorators.http import require_GET
+from rest_framework.viewsets import ViewSet
+from rest_framework.response import Response
+from rest_framework import status
+
+from account.permissions import IsAuthenticated
+from chat_session.views import authenticate, throttle
+from job.models import Job
+from job.serializers import JobSerializer
+from job.services import stream_job_progress
+
+
+class JobViewSet(ViewSet):
+    serializer_class = JobSerializer
+    permission_classes = (IsAuthenticated, )
+
+    def get_queryset(self):
+        return Job.objects.filter(user=self.request.user)
+
+    def get_object(self, pk):
+        try:
+            return get_object_or_404(self.get_queryset(), pk=pk)
+        except ValidationError:
+            raise Http404
+
+    def retrieve(self, request, pk=None, *args, **kwargs):
+        """
+        Retrieve the status, progress and result of a Job identified by its primary key.
+        """
+        job = self.get_object(pk)
+        serializer = self.serializer_class(job)
+
+        return Response(serializer.data, status=status.HTTP_200_OK)
+
+
+@require_GET
+async def job_progress(request: HttpRequest, pk: str):
+    """
+    Stream the state of a Job as server-sent events until it succeeds or fails.
+    """
+    user = await authenticate(request)
+    if user is None:
+        return JsonResponse({'detail': 'Authentication credentials were not provided.'},
+                            status=status.HTTP_401_UNAUTHORIZED)
+
+    throttled = await throttle(request, user)
+    if throttled is not None:
+        return throttled
+
+    try:
+        if not await Job.objects.filter(pk=pk, user=user).aexists():
+            raise Http404
+    except ValidationError:
+        raise Http404
+
+    response = StreamingHttpResponse(stream_job_progress(pk))
+    response['Content-Type'] = 'text/event-stream'
+
+    return response
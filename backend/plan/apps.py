@@ -4,3 +4,7 @@ from django.apps import AppConfig
 class PlanConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'plan'
+
+    def ready(self):
+        # Registers the plan job handlers with the job worker.
+        from plan import jobs
@@ -0,0 +1,101 @@
+import logging
+from datetime import timedelta
+from typing import Any, Dict, List
+
+from django.conf import settings
+from django.utils import timezone
+
+from chat_session.models import ChatSession
+from job.models import Job
+from job.services import enqueue, register, report_progress
+from plan.models import Plan, PlanItemSubtopic
+from plan.serializers import PlanSerializer
+from plan.services import add_questions_batch, add_subtopic_questions, create_plan, fill_subtopic_content
+
+
+logger = logging.getLogger(__name__)
+
+
+def get_subtopic(job: Job) -> PlanItemSubtopic:
+    return (PlanItemSubtopic.objects.select_related('plan_item__plan__chat_session')
+            .get(pk=job.payload['subtopic']))
+
+
+@register('generate_plan')
+def generate_plan(job: Job) -> Dict[str, Any]:
+    chat_session = ChatSession.objects.get(pk=job.payload['session'])
+    report_progress(job, 10, 'Generating the study plan.')
+
+    try:
+        plan = create_plan(chat_session, job.user)
+    except Exception:
+        # Same as the synchronous endpoint, but only once no retry is left.
+        if job.is_last_attempt:
+            chat_session.delete()
+        raise
+
+    prefetch_subtopics(plan)
+    return PlanSerializer(plan).data
+
+
+@register('generate_subtopic_content')
+def generate_subtopic_content(job: Job) -> Dict[str, str]:
+    subtopic = get_subtopic(job)
+    report_progress(job, 10, 'Generating the subtopic content.')
+
+    return {'data': fill_subtopic_content(subtopic, job.payload.get('use_cache', True))}
+
+
+@register('generate_questions')
+def generate_questions(job: Job) -> List[Dict[str, Any]]:
+    subtopic = get_subtopic(job)
+    report_progress(job, 10, 'Generating the questions.')
+
+    return add_subtopic_questions(subtopic)
+
+
+@register('generate_questions_batch')
+def generate_questions_batch(job: Job) -> Dict[str, Any]:
+    plan = Plan.objects.select_related('chat_session').get(pk=job.payload['plan'])
+    subtopics = (PlanItemSubtopic.objects.filter(plan_item__plan=plan, pk__in=job.payload['subtopics'])
+                 .prefetch_related('questions')
+                 .order_by('plan_item__position', 'position'))
+    report_progress(job, 10, 'Generating the questions.')
+
+    return add_questions_batch(plan.chat_session, list(subtopics))
+
+
+@register('prefetch_subtopic_content')
+def prefetch_subtopic_content(job: Job) -> Dict[str, str | None]:
+    subtopic = get_subtopic(job)
+    if not subtopic.plan_item.plan.chat_session.is_active:
+        return {'data': None}
+
+    return {'data': fill_subtopic_content(subtopic)}
+
+
+def prefetch_subtopics(plan: Plan):
+    """
+    Queue content generation for the first SUBTOPIC_PREFETCH_COUNT subtopics of a new plan,
+    within the daily SUBTOPIC_PREFETCH_DAILY_BUDGET of its user.
+
+    The jobs share their dedupe key with generate_content requests, so opening a subtopic
+    that is being prefetched attaches to the running generation.
+    """
+    try:
+        used_budget = Job.objects.filter(user=plan.user, kind='prefetch_subtopic_content',
+                                         created_at__gte=timezone.now() - timedelta(days=1)).count()
+        count = min(settings.SUBTOPIC_PREFETCH_COUNT, settings.SUBTOPIC_PREFETCH_DAILY_BUDGET - used_budget)
+        if count <= 0:
+            return
+
+        subtopics = (PlanItemSubtopic.objects.filter(plan_item__plan=plan)
+                     .filter(body__isnull=True)
+                     .order_by('plan_item__position', 'position')[:count])
+        for subtopic in subtopics:
+            enqueue(plan.user, 'prefetch_subtopic_content',
+                    {'subtopic': str(subtopic.id), 'session': str(plan.chat_session_id)},
+                    dedupe_key=f'generate_subtopic_content:{subtopic.id}')
+    except Exception:
+        # Prefetching is an optimization, the plan is usable without it.
+        logger.exception('Could not queue the subtopic prefetch of plan %s.', plan.pk)
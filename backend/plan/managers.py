@@ -0,0 +1,38 @@
+from django.db import models
+from django.db.models import Prefetch
+
+
+def subtopics_prefetch(lookup: str) -> Prefetch:
+    from plan.models import PlanItemSubtopic
+
+    return Prefetch(lookup, queryset=PlanItemSubtopic.objects.select_related('body'))
+
+
+def questions_prefetch(lookup: str) -> Prefetch:
+    from plan.models import SubtopicQuestion
+
+    return Prefetch(lookup, queryset=SubtopicQuestion.objects.select_related('user_answer').prefetch_related('answers'))
+
+
+class PlanQuerySet(models.QuerySet):
+    def with_tree(self):
+        """
+        Prefetch everything PlanSerializer renders: the session sources, items, subtopics,
+        their questions, answers and user answers, in a fixed number of queries.
+        """
+        from chat_session.models import ChatSource
+
+        return self.select_related('chat_session').prefetch_related(
+            Prefetch('chat_session__sources', queryset=ChatSource.objects.only('id', 'chat_session_id', 'title', 'url'),
+                     to_attr='source_links'),
+            subtopics_prefetch('items__subtopics'),
+            questions_prefetch('items__subtopics__questions'),
+        )
+
+
+class PlanItemSubtopicQuerySet(models.QuerySet):
+    def with_questions(self):
+        """
+        Prefetch everything PlanItemSubtopicSerializer renders in a fixed number of queries.
+        """
+        return self.select_related('plan_item__plan', 'body').prefetch_related(questions_prefetch('questions'))
@@ -0,0 +1,20 @@
+# Generated by Django 5.1 on 2026-10-18 14:20
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat_session', '0010_remove_chatsource_content'),
+        ('plan', '0002_alter_planitem_hours'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='planitemsubtopic',
+            name='body',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='+', to='chat_session.content'),
+        ),
+    ]
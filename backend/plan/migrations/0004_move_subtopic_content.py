@@ -0,0 +1,54 @@
+# Generated by Django 5.1 on 2026-10-18 14:20
+
+from django.db import migrations
+
+
+BATCH_SIZE = 500
+
+
+def forwards(apps, schema_editor):
+    PlanItemSubtopic = apps.get_model('plan', 'PlanItemSubtopic')
+    Content = apps.get_model('chat_session', 'Content')
+
+    subtopics = PlanItemSubtopic.objects.exclude(content__isnull=True).exclude(content='').only('pk', 'content')
+    batch = []
+    for subtopic in subtopics.iterator(chunk_size=BATCH_SIZE):
+        batch.append(subtopic)
+        if len(batch) == BATCH_SIZE:
+            save_batch(PlanItemSubtopic, Content, batch)
+            batch = []
+    if batch:
+        save_batch(PlanItemSubtopic, Content, batch)
+
+
+def save_batch(PlanItemSubtopic, Content, subtopics):
+    contents = Content.objects.bulk_create([Content(text=subtopic.content) for subtopic in subtopics])
+    for subtopic, content in zip(subtopics, contents):
+        subtopic.body = content
+    PlanItemSubtopic.objects.bulk_update(subtopics, ['body'])
+
+
+def backwards(apps, schema_editor):
+    PlanItemSubtopic = apps.get_model('plan', 'PlanItemSubtopic')
+    Content = apps.get_model('chat_session', 'Content')
+
+    content_ids = []
+    subtopics = PlanItemSubtopic.objects.filter(body__isnull=False).select_related('body')
+    for subtopic in subtopics.iterator(chunk_size=BATCH_SIZE):
+        content_ids.append(subtopic.body_id)
+        subtopic.content = subtopic.body.text
+        subtopic.body = None
+        subtopic.save(update_fields=['content', 'body'])
+    Content.objects.filter(pk__in=content_ids).delete()
+
+
+class Migration(migrations.Migration):
+    # Kept apart from the schema changes of plan_planitemsubtopic, see chat_session 0009_move_content.
+
+    dependencies = [
+        ('plan', '0003_planitemsubtopic_body'),
+    ]
+
+    operations = [
+        migrations.RunPython(forwards, backwards),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 5.1 on 2026-10-18 09:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('plan', '0005_remove_planitemsubtopic_content'),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name='planitem',
+            options={'ordering': ['position']},
+        ),
+        migrations.AlterModelOptions(
+            name='planitemsubtopic',
+            options={'ordering': ['position']},
+        ),
+        migrations.AddField(
+            model_name='planitem',
+            name='position',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='planitemsubtopic',
+            name='position',
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 5.1 on 2026-10-18 09:41
+
+from django.db import migrations
+from django.db.models import F, Window
+from django.db.models.functions import RowNumber
+
+
+def forwards(apps, schema_editor):
+    # Items were bulk inserted in plan order, so their auto-incremented ids follow it. The order of
+    # the subtopics of existing plans was not recorded, they keep position 0.
+    PlanItem = apps.get_model('plan', 'PlanItem')
+
+    items = PlanItem.objects.annotate(
+        index=Window(RowNumber(), partition_by=F('plan_id'), order_by=F('id').asc())
+    ).values_list('pk', 'index')
+    PlanItem.objects.bulk_update([PlanItem(pk=pk, position=index - 1) for pk, index in items], ['position'],
+                                 batch_size=500)
+
+
+class Migration(migrations.Migration):
+    # Kept apart from the schema changes of plan_planitem, see chat_session 0009_move_content.
+
+    dependencies = [
+        ('plan', '0006_position'),
+    ]
+
+    operations = [
+        migrations.RunPython(forwards, migrations.RunPython.noop),
+    ]
@@ -1,10 +1,13 @@
 import uuid
 
 from django.db import models
+from django.db.models import Sum
+from django.db.models.signals import post_delete
 from django.forms import ValidationError
 from django.conf import settings
 
-from chat_session.models import ChatSession
+from chat_session.models import ChatSession, Content, ContentOwner, content_accessor, release_content
+from plan.managers import PlanQuerySet, PlanItemSubtopicQuerySet
 
 
 class Plan(models.Model):
@@ -16,6 +19,8 @@ class Plan(models.Model):
     total_hours = models.IntegerField()
     created_at = models.DateTimeField(auto_now_add=True)
 
+    objects = PlanQuerySet.as_manager()
+
     def __str__(self):
         return f'{self.topic} by {self.user}'
 
@@ -24,9 +29,14 @@ class PlanItem(models.Model):
     plan = models.ForeignKey(Plan, on_delete=models.CASCADE, related_name='items')
     theme = models.CharField(max_length=255)
     hours = models.FloatField()
+    # Index of the item in the generated plan, the ids don't follow it.
+    position = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        ordering = ['position']
 
     def save(self, *args, **kwargs):
-        total_plan_item_hours = sum(item.hours for item in self.plan.items.all())
+        total_plan_item_hours = self.plan.items.exclude(pk=self.pk).aggregate(total=Sum('hours'))['total'] or 0
         projected_total_hours = total_plan_item_hours + self.hours
 
         if projected_total_hours > self.plan.total_hours:
@@ -39,18 +49,30 @@ class PlanItem(models.Model):
         return f'{self.theme} plan item for {self.plan}'
 
 
-class PlanItemSubtopic(models.Model):
+class PlanItemSubtopic(ContentOwner, models.Model):
     id = models.UUIDField(default=uuid.uuid4, unique=True, 
                           primary_key=True, editable=False)
     plan_item = models.ForeignKey(PlanItem, on_delete=models.CASCADE, related_name='subtopics')
     name = models.CharField(max_length=255)
     preview = models.TextField()
-    content = models.TextField(null=True, blank=True)
+    body = models.ForeignKey(Content, null=True, blank=True, on_delete=models.PROTECT, related_name='+')
+    # Index of the subtopic in its item of the generated plan.
+    position = models.PositiveIntegerField(default=0)
+
+    objects = PlanItemSubtopicQuerySet.as_manager()
+
+    class Meta:
+        ordering = ['position']
+
+    content = content_accessor()
 
     def __str__(self):
         return f'{self.name} subtopic for {self.plan_item}'
 
 
+post_delete.connect(release_content, sender=PlanItemSubtopic)
+
+
 class SubtopicQuestion(models.Model):
     subtopic = models.ForeignKey(PlanItemSubtopic, on_delete=models.CASCADE, related_name='questions')
     question = models.CharField(max_length=255)
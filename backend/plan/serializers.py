@@ -90,6 +90,14 @@ class SubtopicQuestionSerializer(serializers.ModelSerializer):
         return representation
 
 
+class GeneratedQuestionSerializer(SubtopicQuestionSerializer):
+    """
+    Validates generated questions of a subtopic that is known already, without looking it up for every question.
+    """
+    class Meta(SubtopicQuestionSerializer.Meta):
+        fields = ['question', 'answers']
+
+
 class PlanItemSubtopicSerializer(serializers.ModelSerializer):
     questions = SubtopicQuestionSerializer(many=True, read_only=True)
     plan = serializers.SerializerMethodField(read_only=True)
@@ -118,16 +126,6 @@ class PlanItemSerializer(serializers.ModelSerializer):
     class Meta:
         model = PlanItem
         fields = ['theme', 'hours', 'subtopics']
-    
-    def create(self, validated_data):
-        with transaction.atomic():
-            subtopics_data = validated_data.pop('subtopics', [])
-            plan_item = PlanItem.objects.create(**validated_data)
-
-            for subtopic in subtopics_data:
-                PlanItemSubtopic.objects.create(plan_item=plan_item, **subtopic)
-            
-            return plan_item
 
 
 class PlanSerializer(serializers.ModelSerializer):
@@ -142,19 +140,39 @@ class PlanSerializer(serializers.ModelSerializer):
             'user': {'write_only': True}
         }
     
+    def validate(self, data):
+        # Checked here for the whole plan at once, bulk inserted items skip PlanItem.save.
+        items_hours = sum(item['hours'] for item in data.get('items', []))
+        if items_hours > data['total_hours']:
+            raise serializers.ValidationError(f'The plan items add up to {items_hours} hours, which exceeds '
+                                              f'the total allowed hours for this plan ({data["total_hours"]} hours).')
+
+        return data
+
     def create(self, validated_data):
         with transaction.atomic():
             items_data = validated_data.pop('items', [])
             plan = Plan.objects.create(**validated_data)
 
-            for plan_item in items_data:
-                plan_item['plan'] = plan
-                PlanItemSerializer().create(plan_item)
+            plan_items = PlanItem.objects.bulk_create([
+                PlanItem(plan=plan, theme=item['theme'], hours=item['hours'], position=position)
+                for position, item in enumerate(items_data)
+            ])
+            PlanItemSubtopic.objects.bulk_create([
+                PlanItemSubtopic(plan_item=plan_item, position=position, **subtopic)
+                for plan_item, item in zip(plan_items, items_data)
+                for position, subtopic in enumerate(item.get('subtopics', []))
+            ])
             
             return plan
 
     def get_sources(self, obj):
+        # Prefetched without the page content by Plan.objects.with_tree().
+        sources = getattr(obj.chat_session, 'source_links', None)
+        if sources is None:
+            sources = obj.chat_session.sources.only('title', 'url')
+
         return [{
-            'title': source.get('title'),
-            'url': source.get('url')
-        } for source in obj.chat_session.sources.values('title', 'url')]
+            'title': source.title,
+            'url': source.url
+        } for source in sources]
@@ -1,36 +1,273 @@
-from typing import Dict, Any
+import hashlib
+import logging
+from typing import Dict, Any, List, Tuple
 
+from django.core.cache import caches
 from django.db import transaction
 
-from chat_session.models import ChatSession, ChatMessage
-from chat_session.services import get_llama_response
+from chat_session import metrics
+from chat_session.models import ChatSession
+from chat_session.services import LLM_MODEL, get_completion, get_grounding_prompt, get_llama_response, normalize_query, parse_json_response
+from plan.models import Plan, PlanItemSubtopic, SubtopicQuestion, QuestionAnswer
+from plan.serializers import GeneratedQuestionSerializer, PlanSerializer, SubtopicQuestionSerializer
 
 
-def generate_subtopic_content(chat_session: ChatSession, topic: str) -> Dict[str, Any] | None:
+logger = logging.getLogger(__name__)
+
+# Part of the article cache key, bump it whenever the subtopic content prompt changes.
+SUBTOPIC_CONTENT_PROMPT_VERSION = 1
+QUESTION_JSON_FORMAT = ('{ "question": "string representing the question itself", '
+                        '"answers": [ { "content": "string representing the answer", '
+                        '"is_correct": boolean value indicating if the answer is correct (true or false) } ] }')
+
+
+def generate_subtopic_content(chat_session: ChatSession, topic: str) -> str | None:
+    return get_completion([{
+        'role': 'system',
+        'content': (get_grounding_prompt(chat_session, topic) + '\n\n'
+                    '[Output only Markdown] '
+                    f'Generate a detailed description for the topic "{topic}", including examples as needed. '
+                    'Use the teaching information above where it is relevant. '
+                    'Ensure the response is well-formatted using Markdown. '
+                    'Do not include any greetings or extra content.')
+    }])
+
+
+def generate_questions(chat_session: ChatSession, topic: str, existing_questions: List[str] = ()) -> Dict[str, Any] | None:
+    previous_questions = ''
+    if existing_questions:
+        previous_questions = ('Do not repeat any of these previously asked questions: '
+                              + ' | '.join(existing_questions) + '. ')
+
+    response_content = get_completion([{
+        'role': 'system',
+        'content': (get_grounding_prompt(chat_session, topic) + '\n\n'
+                    '[Output only JSON] '
+                    f'Generate exactly 5 unique questions on the topic "{topic}". '
+                    'Each question must have at least 3 distinct answer options, with only one correct answer. '
+                    'Randomize the position of the correct answer within the list of options. '
+                    f'Ensure that all questions are unique. {previous_questions}'
+                    'Return the results in pure JSON format as follows: '
+                    f'{{ "questions": [ {QUESTION_JSON_FORMAT} ] }}. '
+                    'The JSON must be valid with all brackets and parentheses properly closed. '
+                    'Do not include line breaks ("\\n") or extra formatting. Ensure there are exactly 5 questions.')
+    }])
+
+    if response_content is None:
+        return None
+    return parse_json_response(response_content)
+
+
+def generate_questions_batch(chat_session: ChatSession, topics: List[str],
+                             existing_questions: List[List[str]]) -> Dict[int, Any]:
+    """
+    Generate questions for several topics in a single request, returning the questions
+    data of every topic the response covers by the topic index.
+    """
+    topics_list = ''
+    for index, (topic, previous) in enumerate(zip(topics, existing_questions), start=1):
+        topics_list += f'{index}. "{topic}"'
+        if previous:
+            topics_list += ' (do not repeat: ' + ' | '.join(previous) + ')'
+        topics_list += '\n'
+
+    response_content = get_completion([{
+        'role': 'system',
+        'content': (get_grounding_prompt(chat_session, ' '.join(topics)) + '\n\n'
+                    '[Output only JSON] '
+                    'Generate exactly 5 unique questions for each of the numbered topics below. '
+                    'Each question must have at least 3 distinct answer options, with only one correct answer. '
+                    'Randomize the position of the correct answer within the list of options. '
+                    'Ensure that all questions are unique and do not repeat the previously asked questions '
+                    'listed next to a topic.\n' + topics_list +
+                    'Return the results in pure JSON format as follows: '
+                    '{ "topics": [ { "index": number of the topic in the list above, '
+                    f'"questions": [ {QUESTION_JSON_FORMAT} ] }} ] }}. '
+                    'The JSON must be valid with all brackets and parentheses properly closed. '
+                    'Do not include line breaks ("\\n") or extra formatting. '
+                    'Ensure there is an entry with exactly 5 questions for every topic.')
+    }])
+
+    if response_content is None:
+        return {}
+
+    response_topics = parse_json_response(response_content).get('topics')
+    if not isinstance(response_topics, list):
+        return {}
+
+    return {topic['index'] - 1: topic.get('questions') for topic in response_topics
+            if isinstance(topic, dict) and isinstance(topic.get('index'), int) and 1 <= topic['index'] <= len(topics)}
+
+
+def validate_questions(subtopic: PlanItemSubtopic, questions_data: Any) -> List[Dict[str, Any]] | None:
+    """
+    Validated questions of the subtopic, or None if the data is not a non-empty list
+    of questions with exactly one correct answer each.
+    """
+    if not isinstance(questions_data, list) or not questions_data:
+        return None
+    if not all(isinstance(question, dict) for question in questions_data):
+        return None
+
+    serializer = GeneratedQuestionSerializer(data=questions_data, many=True)
+    if not serializer.is_valid():
+        return None
+
+    if any(sum(answer.get('is_correct', False) for answer in question['answers']) != 1
+           for question in serializer.validated_data):
+        return None
+    return serializer.validated_data
+
+
+def save_questions(validated_questions: List[Tuple[PlanItemSubtopic, List[Dict[str, Any]]]]) -> List[SubtopicQuestion]:
+    """
+    Insert the questions of several subtopics and their answers with one bulk insert each.
+    """
+    questions, answers = [], []
+    for subtopic, questions_data in validated_questions:
+        for question_data in questions_data:
+            question = SubtopicQuestion(subtopic=subtopic, question=question_data['question'])
+            questions.append(question)
+            answers.extend(QuestionAnswer(question=question, **answer) for answer in question_data['answers'])
+
+    with transaction.atomic():
+        SubtopicQuestion.objects.bulk_create(questions)
+        QuestionAnswer.objects.bulk_create(answers)
+
+    return questions
+
+
+def with_answers(questions: List[SubtopicQuestion]):
+    """
+    The saved questions again, with their answers and user answers prefetched for serialization.
+    """
+    return (SubtopicQuestion.objects.filter(pk__in=[question.pk for question in questions])
+            .select_related('user_answer').prefetch_related('answers').order_by('id'))
+
+
+def add_questions_batch(chat_session: ChatSession, subtopics: List[PlanItemSubtopic]) -> Dict[str, Any]:
+    """
+    Generate and save questions for several subtopics with a single LLM request.
+
+    Subtopics whose part of the response fails validation fall back to a request of their own.
+    Returns the serialized questions by subtopic id and the errors of subtopics that still failed.
+    """
+    try:
+        batch_questions = generate_questions_batch(
+            chat_session, [subtopic.name for subtopic in subtopics],
+            [[question.question for question in subtopic.questions.all()] for subtopic in subtopics]
+        )
+    except Exception:
+        logger.exception('Batched question generation failed, generating per subtopic.')
+        batch_questions = {}
+
+    validated, failed = [], []
+    for index, subtopic in enumerate(subtopics):
+        questions_data = validate_questions(subtopic, batch_questions.get(index))
+        if questions_data is None:
+            failed.append(subtopic)
+        else:
+            validated.append((subtopic, questions_data))
+
+    metrics.increment('quiz_batch_subtopics', len(subtopics))
+    if failed:
+        metrics.increment('quiz_batch_fallbacks', len(failed))
+
+    saved_questions = with_answers(save_questions(validated))
+
+    result = {'questions': {str(subtopic.id): [] for subtopic, _ in validated}, 'errors': {}}
+    for question in saved_questions:
+        result['questions'][str(question.subtopic_id)].append(SubtopicQuestionSerializer(question).data)
+
+    for subtopic in failed:
+        try:
+            result['questions'][str(subtopic.id)] = add_subtopic_questions(subtopic)
+        except Exception as e:
+            result['errors'][str(subtopic.id)] = str(e)
+
+    return result
+
+
+def create_plan(chat_session: ChatSession, user) -> Plan:
+    """
+    Generate the Plan of a ChatSession, or return the one it already has.
+
+    The session row stays locked while the plan is generated, so concurrent callers
+    wait for the running generation and get its plan instead of starting another one.
+    """
     with transaction.atomic():
-        ChatMessage.objects.create(chat_session=chat_session, role='system',
-                                content=('[Output only Markdown] '
-                                        f'Generate a detailed description for the topic "{topic}", including examples as needed. '
-                                        'Ensure the response is well-formatted using Markdown. '
-                                        'Do not include any greetings or extra content.'
-                                        ))
-        
-        return get_llama_response(chat_session=chat_session, is_json=False)
+        ChatSession.objects.select_for_update().values_list('pk').get(pk=chat_session.pk)
+        existing_plan = chat_session.plans.first()
+        if existing_plan:
+            return existing_plan
+
+        new_plan_data = get_llama_response(chat_session=chat_session, is_json=True)
+
+        serializer = PlanSerializer(data={
+            'chat_session': chat_session.id,
+            'user': user.id,
+            'topic': new_plan_data.get('topic'),
+            'total_hours': new_plan_data.get('total_hours'),
+            'items': new_plan_data.get('study_plan')
+        })
+        serializer.is_valid(raise_exception=True)
+        return serializer.save()
 
 
-def generate_questions(chat_session: ChatSession, topic: str) -> Dict[str, Any] | None:
+def article_cache_key(subtopic: PlanItemSubtopic) -> str:
+    key = '\n'.join([str(SUBTOPIC_CONTENT_PROMPT_VERSION), LLM_MODEL,
+                     normalize_query(subtopic.plan_item.plan.topic), normalize_query(subtopic.name)])
+    return f'article:{hashlib.sha256(key.encode()).hexdigest()}'
+
+
+def get_article(subtopic: PlanItemSubtopic, use_cache: bool = True) -> str | None:
+    """
+    Content for the subtopic from the shared article cache, generated and cached on a miss.
+    With `use_cache` off, the article is always generated and replaces the cached one.
+    """
+    article_cache = caches['articles']
+    cache_key = article_cache_key(subtopic)
+
+    if use_cache:
+        content = article_cache.get(cache_key)
+        if content is not None:
+            metrics.increment('article_cache_hit')
+            return content
+        metrics.increment('article_cache_miss')
+
+    content = generate_subtopic_content(subtopic.plan_item.plan.chat_session, subtopic.name)
+    if content:
+        article_cache.set(cache_key, content)
+    return content
+
+
+def fill_subtopic_content(subtopic: PlanItemSubtopic, use_cache: bool = True) -> str:
+    """
+    Fill the subtopic content unless it already has some. Like create_plan, concurrent
+    callers wait on the subtopic row lock and share the result of a single generation.
+    """
+    if subtopic.content:
+        return subtopic.content
+
     with transaction.atomic():
-        ChatMessage.objects.create(chat_session=chat_session, role='system',
-                                content=('[Output only JSON] '
-                                        f'Generate exactly 5 unique questions on the topic "{topic}". '
-                                        'Each question must have at least 3 distinct answer options, with only one correct answer. '
-                                        'Randomize the position of the correct answer within the list of options. '
-                                        'Ensure that all questions are unique and have not been used before. '
-                                        'Return the results in pure JSON format as follows: '
-                                        '{ "questions": [ { "question": "string representing the question itself", '
-                                        '"answers": [ { "content": "string representing the answer", '
-                                        '"is_correct": boolean value indicating if the answer is correct (true or false) } ] } ] }. '
-                                        'The JSON must be valid with all brackets and parentheses properly closed. '
-                                        'Do not include line breaks ("\\n") or extra formatting. Ensure there are exactly 5 questions.'))
-        
-        return get_llama_response(chat_session=chat_session, is_json=True)
+        subtopic.body_id = (PlanItemSubtopic.objects.select_for_update()
+                            .values_list('body_id', flat=True).get(pk=subtopic.pk))
+        if not subtopic.content:
+            subtopic.content = get_article(subtopic, use_cache)
+            subtopic.save(update_fields=['body'])
+
+    return subtopic.content
+
+
+def add_subtopic_questions(subtopic: PlanItemSubtopic) -> List[Dict[str, Any]]:
+    """
+    Generate and save a new batch of questions for the subtopic, returning their serialized data.
+    """
+    questions = generate_questions(subtopic.plan_item.plan.chat_session, subtopic.name,
+                                   [question.question for question in subtopic.questions.all()])
+
+    serializer = GeneratedQuestionSerializer(data=questions.get('questions', []), many=True)
+    serializer.is_valid(raise_exception=True)
+
+    return SubtopicQuestionSerializer(with_answers(save_questions([(subtopic, serializer.validated_data)])),
+                                      many=True).data
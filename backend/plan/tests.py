@@ -1,3 +1,197 @@
-from django.test import TestCase
+import json
+from unittest import mock
 
-# Create your tests here.
+from django.test import TestCase, override_settings
+from rest_framework.test import APIClient
+
+from account.models import Account
+from chat_session.models import ChatSession, ChatSource, Metric
+from job.models import Job
+from plan.jobs import prefetch_subtopics
+from plan.models import Plan, PlanItem, PlanItemSubtopic, SubtopicQuestion, QuestionAnswer, UserAnswer
+from plan.serializers import PlanSerializer
+from plan.services import add_questions_batch
+
+
+def create_plan_tree(user, items: int = 3, subtopics: int = 4, questions: int = 3) -> Plan:
+    """
+    A plan with sources, items, subtopics with content, and questions with answers, the first
+    question of every subtopic answered by the user.
+    """
+    chat_session = ChatSession.objects.create(user=user)
+    for index in range(3):
+        source = ChatSource(chat_session=chat_session, title=f'Source {index}', url=f'https://example.com/{index}')
+        source.content = f'Text of source {index}.'
+        source.save()
+
+    plan = Plan.objects.create(chat_session=chat_session, user=user, topic='Topic', total_hours=items)
+    for item_index in range(items):
+        item = PlanItem.objects.create(plan=plan, theme=f'Theme {item_index}', hours=1, position=item_index)
+        for subtopic_index in range(subtopics):
+            subtopic = PlanItemSubtopic(plan_item=item, name=f'Subtopic {subtopic_index}', preview='Preview',
+                                        position=subtopic_index)
+            subtopic.content = f'Content of subtopic {item_index}.{subtopic_index}.'
+            subtopic.save()
+
+            for question_index in range(questions):
+                question = SubtopicQuestion.objects.create(subtopic=subtopic, question=f'Question {question_index}?')
+                correct = QuestionAnswer.objects.create(question=question, content='Yes', is_correct=True)
+                QuestionAnswer.objects.create(question=question, content='No')
+                if not question_index:
+                    UserAnswer.objects.create(question=question, selected_answer=correct)
+
+    return plan
+
+
+class ReadQueriesTests(TestCase):
+    """
+    The read endpoints run a fixed number of queries, however large the plans are.
+    """
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = Account.objects.create_user('reader@example.com', 'password', username='reader')
+        cls.plans = [create_plan_tree(cls.user), create_plan_tree(cls.user, items=5, subtopics=6, questions=5)]
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.user, token='token')
+
+    def test_plan_list(self):
+        with self.assertNumQueries(6):
+            response = self.client.get('/plans/')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data), 2)
+
+    def test_plan_retrieve(self):
+        for plan in self.plans:
+            with self.assertNumQueries(6):
+                response = self.client.get(f'/plans/{plan.pk}/')
+
+            self.assertEqual(response.status_code, 200)
+
+    def test_subtopic_retrieve(self):
+        subtopic = PlanItemSubtopic.objects.filter(plan_item__plan=self.plans[1]).first()
+        with self.assertNumQueries(3):
+            response = self.client.get(f'/plans/subtopics/{subtopic.pk}/')
+
+        self.assertEqual(response.status_code, 200)
+        # Answered questions are left out.
+        self.assertEqual(len(response.data['questions']), 4)
+
+
+class PlanCreateQueriesTests(TestCase):
+    """
+    Saving a generated plan runs a fixed number of queries, however many items and subtopics it has.
+    """
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = Account.objects.create_user('planner@example.com', 'password', username='planner')
+        cls.chat_session = ChatSession.objects.create(user=cls.user)
+
+    def plan_data(self, items: int, subtopics: int, hours: float = 1):
+        return {
+            'chat_session': self.chat_session.id,
+            'user': self.user.id,
+            'topic': 'Topic',
+            'total_hours': items,
+            'items': [{
+                'theme': f'Theme {item_index}',
+                'hours': hours,
+                'subtopics': [{'name': f'Subtopic {index}', 'preview': 'Preview'} for index in range(subtopics)]
+            } for item_index in range(items)]
+        }
+
+    def test_create(self):
+        for items, subtopics in ((2, 2), (8, 6)):
+            serializer = PlanSerializer(data=self.plan_data(items, subtopics))
+            # The chat session and user lookups, then the plan, its items and its subtopics within a savepoint.
+            with self.assertNumQueries(7):
+                serializer.is_valid(raise_exception=True)
+                plan = serializer.save()
+
+            self.assertEqual(plan.items.count(), items)
+            self.assertEqual(PlanItemSubtopic.objects.filter(plan_item__plan=plan).count(), items * subtopics)
+
+    def test_hours_over_total(self):
+        serializer = PlanSerializer(data=self.plan_data(3, 2, hours=1.5))
+
+        self.assertFalse(serializer.is_valid())
+        self.assertFalse(Plan.objects.exists())
+
+
+    @override_settings(SUBTOPIC_PREFETCH_COUNT=4, SUBTOPIC_PREFETCH_DAILY_BUDGET=10)
+    def test_prefetch_follows_plan_order(self):
+        data = self.plan_data(3, 3)
+        for item_index, item in enumerate(data['items']):
+            for index, subtopic in enumerate(item['subtopics']):
+                subtopic['name'] = f'Subtopic {item_index}.{index}'
+        serializer = PlanSerializer(data=data)
+        serializer.is_valid(raise_exception=True)
+        plan = serializer.save()
+
+        prefetch_subtopics(plan)
+
+        subtopic_ids = [job.payload['subtopic'] for job in Job.objects.filter(kind='prefetch_subtopic_content')]
+        self.assertEqual(set(PlanItemSubtopic.objects.filter(pk__in=subtopic_ids).values_list('name', flat=True)),
+                         {'Subtopic 0.0', 'Subtopic 0.1', 'Subtopic 0.2', 'Subtopic 1.0'})
+        self.assertEqual([subtopic.name for subtopic in plan.items.all()[1].subtopics.all()],
+                         ['Subtopic 1.0', 'Subtopic 1.1', 'Subtopic 1.2'])
+
+
+def generated_questions(count: int = 5):
+    return [{
+        'question': f'Generated question {index}?',
+        'answers': [{'content': 'Right', 'is_correct': True}, {'content': 'Wrong', 'is_correct': False},
+                    {'content': 'Also wrong', 'is_correct': False}]
+    } for index in range(count)]
+
+
+class QuestionsBatchQueriesTests(TestCase):
+    """
+    Saving a batch of generated questions runs a fixed number of queries, however many
+    subtopics and questions it holds, and so does each subtopic that falls back to a request of its own.
+    """
+    @classmethod
+    def setUpTestData(cls):
+        user = Account.objects.create_user('learner@example.com', 'password', username='learner')
+        cls.plan = create_plan_tree(user, items=2, subtopics=4, questions=2)
+        # Counters are created on first use, which takes more queries than incrementing them.
+        Metric.objects.bulk_create([Metric(name='quiz_batch_subtopics'), Metric(name='quiz_batch_fallbacks')])
+
+    def get_subtopics(self, count: int):
+        # Loaded the way PlanViewSet.generate_questions and the generate_questions_batch job load them.
+        return list(PlanItemSubtopic.objects.filter(plan_item__plan=self.plan)
+                    .select_related('plan_item__plan__chat_session')
+                    .prefetch_related('questions')
+                    .order_by('plan_item__position', 'position')[:count])
+
+    def generate(self, subtopics, responses):
+        with mock.patch('plan.services.get_completion', side_effect=[json.dumps(response) for response in responses]):
+            return add_questions_batch(self.plan.chat_session, subtopics)
+
+    def test_batch(self):
+        for count in (2, 8):
+            subtopics = self.get_subtopics(count)
+            response = {'topics': [{'index': index + 1, 'questions': generated_questions()}
+                                   for index in range(count)]}
+
+            # Grounding, the metric, 4 for the bulk inserts, 2 to read the questions back.
+            with self.assertNumQueries(8):
+                result = self.generate(subtopics, [response])
+
+            self.assertEqual(result['errors'], {})
+            self.assertEqual([len(result['questions'][str(subtopic.id)]) for subtopic in subtopics], [5] * count)
+
+    def test_fallback(self):
+        subtopics = self.get_subtopics(4)
+        # Only the first subtopic is covered by the batched response, the others are requested one by one.
+        responses = [{'topics': [{'index': 1, 'questions': generated_questions()}]}]
+        responses += [{'questions': generated_questions()}] * 3
+
+        # The batch with its fallback metric, then grounding, 4 for the bulk inserts and 2 reads per fallback.
+        with self.assertNumQueries(9 + 3 * 7):
+            result = self.generate(subtopics, responses)
+
+        self.assertEqual(result['errors'], {})
+        self.assertEqual([len(result['questions'][str(subtopic.id)]) for subtopic in subtopics], [5] * 4)
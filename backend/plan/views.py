@@ -2,13 +2,25 @@ from rest_framework.response import Response
 from rest_framework import status
 from rest_framework.viewsets import ViewSet
 from rest_framework.decorators import action
+from rest_framework.exceptions import ValidationError
+from django.conf import settings
+from django.core.exceptions import ValidationError as DjangoValidationError
 from django.shortcuts import get_object_or_404
 
-from plan.services import get_llama_response, generate_subtopic_content, generate_questions
-from plan.serializers import PlanSerializer, PlanItemSubtopicSerializer, SubtopicQuestionSerializer, UserAnswerSerializer
+from plan.jobs import prefetch_subtopics
+from plan.services import add_questions_batch, add_subtopic_questions, create_plan, fill_subtopic_content
+from plan.serializers import PlanSerializer, PlanItemSubtopicSerializer, UserAnswerSerializer
 from plan.models import PlanItemSubtopic
 from chat_session.models import ChatSession
+from job.serializers import JobSerializer
+from job.services import enqueue
 from account.permissions import IsAuthenticated
+from study_helper.query_budget import query_budget
+
+
+def enqueued_response(request, kind: str, payload: dict, dedupe_key: str = '') -> Response:
+    job = enqueue(request.user, kind, payload, dedupe_key)
+    return Response(JobSerializer(job).data, status=status.HTTP_202_ACCEPTED)
 
 
 class PlanViewSet(ViewSet):
@@ -21,18 +33,20 @@ class PlanViewSet(ViewSet):
     def get_object(self, pk):
         return get_object_or_404(self.get_queryset(), pk=pk)
 
+    @query_budget(6)
     def list(self, request, *args, **kwargs):
         """
         Get a list of all the Plans that belong to the current user.
         """
-        serializer = self.serializer_class(self.get_queryset(), many=True)
+        serializer = self.serializer_class(self.get_queryset().with_tree(), many=True)
         return Response(serializer.data, status=status.HTTP_200_OK)
 
+    @query_budget(6)
     def retrieve(self, request, pk=None, *args, **kwargs):
         """
         Retrieve the Plan instance identified by its primary key.
         """
-        plan = self.get_object(pk)
+        plan = get_object_or_404(self.get_queryset().with_tree(), pk=pk)
         serializer = self.serializer_class(plan)
 
         return Response(serializer.data, status=status.HTTP_200_OK)
@@ -41,6 +55,8 @@ class PlanViewSet(ViewSet):
     def generate(self, request, *args, **kwargs):
         """
         Create a new Plan instance based on a ChatSession.
+
+        With `background` set, the plan is generated by a job worker and the queued Job is returned.
         """
         chat_session = get_object_or_404(ChatSession, pk=request.data.get('session', ''))
         existing_plan = chat_session.plans.first()
@@ -49,25 +65,74 @@ class PlanViewSet(ViewSet):
             serializer = self.serializer_class(existing_plan)
             return Response(serializer.data, status=status.HTTP_200_OK)
 
+        if request.data.get('background'):
+            return enqueued_response(request, 'generate_plan', {'session': str(chat_session.id)},
+                                     dedupe_key=f'generate_plan:{chat_session.id}')
+
         try:
-            new_plan_data = get_llama_response(chat_session=chat_session, is_json=True)
+            plan = create_plan(chat_session, request.user)
+        except ValidationError:
+            raise
         except Exception as e:
             chat_session.delete()
             return Response({'details': f'An unexpected error occurred while generating plan: {str(e)}'}, 
                             status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
-        serializer = self.serializer_class(data={
-            'chat_session': chat_session.id,
-            'user': request.user.id,
-            'topic': new_plan_data.get('topic'),
-            'total_hours': new_plan_data.get('total_hours'),
-            'items': new_plan_data.get('study_plan')
-        })
-        serializer.is_valid(raise_exception=True)
-        serializer.save()
-
+        prefetch_subtopics(plan)
+        serializer = self.serializer_class(plan)
         return Response(serializer.data, status=status.HTTP_201_CREATED)
 
+    @action(detail=True, methods=['post'])
+    def generate_questions(self, request, pk=None, *args, **kwargs):
+        """
+        Generate questions for several subtopics of a Plan in a single LLM request.
+
+        Takes the `subtopics` ids, all subtopics of the plan by default. Subtopics that already
+        have the maximum number of questions are skipped. With `background` set, the questions
+        are generated by a job worker and the queued Job is returned.
+        """
+        plan = self.get_object(pk)
+        subtopic_ids = request.data.get('subtopics')
+
+        subtopics = (PlanItemSubtopic.objects.filter(plan_item__plan=plan)
+                     .select_related('plan_item__plan__chat_session')
+                     .prefetch_related('questions')
+                     .order_by('plan_item__position', 'position'))
+        if subtopic_ids is not None:
+            if not isinstance(subtopic_ids, list):
+                return Response({'details': ('Invalid format for subtopics field. '
+                                             f'Expected a list of subtopic ids, but got type {type(subtopic_ids).__name__}.')},
+                                status=status.HTTP_400_BAD_REQUEST)
+            subtopics = subtopics.filter(pk__in=subtopic_ids)
+
+        try:
+            subtopics = [subtopic for subtopic in subtopics if len(subtopic.questions.all()) < 20]
+        except DjangoValidationError:
+            return Response({'details': 'The subtopics field contains an invalid subtopic id.'},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        if not subtopics:
+            return Response({'details': 'There are no subtopics below the maximum number of questions (20).'}, 
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        if len(subtopics) > settings.QUIZ_BATCH_MAX_SUBTOPICS:
+            return Response({'details': f'At most {settings.QUIZ_BATCH_MAX_SUBTOPICS} subtopics can be processed at once.'}, 
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        if request.data.get('background'):
+            return enqueued_response(request, 'generate_questions_batch', {
+                'plan': str(plan.id),
+                'subtopics': [str(subtopic.id) for subtopic in subtopics]
+            })
+
+        try:
+            result = add_questions_batch(plan.chat_session, subtopics)
+        except Exception as e:
+            return Response({'details': f'An unexpected error occurred while generating questions: {str(e)}'}, 
+                            status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+        return Response(result, status=status.HTTP_201_CREATED)
+
 
 class SubtopicViewSet(ViewSet):
     queryset = PlanItemSubtopic.objects.select_related('plan_item__plan__chat_session')
@@ -81,11 +146,12 @@ class SubtopicViewSet(ViewSet):
     def get_object(self, pk):
         return get_object_or_404(self.get_queryset(), pk=pk)
 
+    @query_budget(3)
     def retrieve(self, request, pk=None, *args, **kwargs):
         """
         Retrieve a Subtopic instance identified by its primary key.
         """
-        subtopic = self.get_object(pk)
+        subtopic = get_object_or_404(self.get_queryset().with_questions(), pk=pk)
         serializer = self.serializer_class(subtopic)
 
         return Response(serializer.data, status=status.HTTP_200_OK)
@@ -94,15 +160,24 @@ class SubtopicViewSet(ViewSet):
     def generate_content(self, request, pk=None, *args, **kwargs):
         """
         Generate content for a subtopic identified by its primary key.
+
+        With `background` set, the content is generated by a job worker and the queued Job is returned.
+        Content is served from the articles generated for the same subtopic of other plans unless
+        `use_cache` is false.
         """
         subtopic = self.get_object(pk)
+        use_cache = request.data.get('use_cache', True) not in (False, 'false', '0', 0)
 
         if subtopic.content:
             return Response({'data': subtopic.content}, status=status.HTTP_200_OK)
 
+        if request.data.get('background'):
+            return enqueued_response(request, 'generate_subtopic_content',
+                                     {'subtopic': str(subtopic.id), 'use_cache': use_cache},
+                                     dedupe_key=f'generate_subtopic_content:{subtopic.id}')
+
         try:
-            subtopic.content = generate_subtopic_content(subtopic.plan_item.plan.chat_session, subtopic.name)
-            subtopic.save()
+            fill_subtopic_content(subtopic, use_cache)
         except Exception as e:
             return Response({'details': f'An unexpected error occurred while generating content: {str(e)}'}, 
                             status=status.HTTP_500_INTERNAL_SERVER_ERROR)
@@ -113,6 +188,8 @@ class SubtopicViewSet(ViewSet):
     def generate_questions(self, request, pk=None, *args, **kwargs):
         """
         Generate questions for a subtopic identified by its primary key.
+
+        With `background` set, the questions are generated by a job worker and the queued Job is returned.
         """
         subtopic = self.get_object(pk)
 
@@ -120,22 +197,18 @@ class SubtopicViewSet(ViewSet):
             return Response({'details': 'The maximum number of questions (20) has already been generated for this subtopic.'}, 
                             status=status.HTTP_400_BAD_REQUEST)
         
+        if request.data.get('background'):
+            return enqueued_response(request, 'generate_questions', {'subtopic': str(subtopic.id)})
+
         try:
-            questions = generate_questions(subtopic.plan_item.plan.chat_session, subtopic.name)
-            questions_data = questions.get('questions', [])
+            questions_data = add_subtopic_questions(subtopic)
+        except ValidationError:
+            raise
         except Exception as e:
             return Response({'details': f'An unexpected error occurred while generating questions: {str(e)}'}, 
                             status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
-        serializer = SubtopicQuestionSerializer(data=[{
-            'subtopic': subtopic.id,
-            **question
-        } for question in questions_data], many=True)
-
-        serializer.is_valid(raise_exception=True)
-        serializer.save()
-
-        return Response(serializer.data, status=status.HTTP_201_CREATED)
+        return Response(questions_data, status=status.HTTP_201_CREATED)
 
     @action(detail=True, methods=['post'])
     def submit_answers(self, request, pk=None, *args, **kwargs):
@@ -4,4 +4,5 @@ set -o errexit
 set -o nounset
 
 python manage.py migrate
-python manage.py runserver 0.0.0.0:8000
\ No newline at end of file
+python manage.py createcachetable
+uvicorn study_helper.asgi:application --host 0.0.0.0 --port 8000
\ No newline at end of file
@@ -0,0 +1,33 @@
+from functools import wraps
+
+from django.conf import settings
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+
+class QueryBudgetExceeded(Exception):
+    pass
+
+
+def query_budget(max_queries: int):
+    """
+    Declare the most database queries a view may run. While QUERY_BUDGET_CHECKS is on,
+    as in development and CI, a view that runs more raises QueryBudgetExceeded listing them.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            if not settings.QUERY_BUDGET_CHECKS:
+                return view(*args, **kwargs)
+
+            with CaptureQueriesContext(connection) as queries:
+                response = view(*args, **kwargs)
+
+            if len(queries) > max_queries:
+                executed = '\n'.join(query['sql'] for query in queries.captured_queries)
+                raise QueryBudgetExceeded(f'{view.__qualname__} ran {len(queries)} queries, '
+                                          f'over its budget of {max_queries}:\n{executed}')
+            return response
+
+        return wrapper
+    return decorator
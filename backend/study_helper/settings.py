@@ -14,6 +14,8 @@ from pathlib import Path
 from datetime import timedelta
 import os
 
+from corsheaders.defaults import default_headers
+
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -56,6 +58,9 @@ else:
     ALLOWED_HOSTS = ['*']
     CORS_ALLOW_ALL_ORIGINS = True
 
+# Sent by the chat client to resume a streamed reply after a dropped connection.
+CORS_ALLOW_HEADERS = (*default_headers, 'last-event-id')
+
 # Application definition
 
 INSTALLED_APPS = [
@@ -72,6 +77,7 @@ INSTALLED_APPS = [
     'account',
     'chat_session',
     'plan',
+    'job',
 ]
 
 MIDDLEWARE = [
@@ -149,6 +155,11 @@ DATABASES = {
 }
 
 
+# Views decorated with study_helper.query_budget.query_budget fail when they run more
+# queries than declared. On by default in development, set it in CI as well.
+QUERY_BUDGET_CHECKS = os.environ.get('QUERY_BUDGET_CHECKS', str(DEBUG)).lower() == 'true'
+
+
 # Password validation
 # https://docs.djangoproject.com/en/5.1/ref/settings/#auth-password-validators
 
@@ -189,3 +200,135 @@ STATIC_URL = 'static/'
 # https://docs.djangoproject.com/en/5.1/ref/settings/#default-auto-field
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
+
+
+# Sources fetching
+# Connect and read timeouts are applied to every source host, while the deadline
+# bounds the whole concurrent fetch stage.
+
+SOURCES_FETCH_WORKERS = int(os.environ.get('SOURCES_FETCH_WORKERS', 5))
+SOURCES_CONNECT_TIMEOUT = float(os.environ.get('SOURCES_CONNECT_TIMEOUT', 3))
+SOURCES_READ_TIMEOUT = float(os.environ.get('SOURCES_READ_TIMEOUT', 5))
+SOURCES_FETCH_DEADLINE = float(os.environ.get('SOURCES_FETCH_DEADLINE', 8))
+
+# Page text extraction engine, one of chat_session.extractors.EXTRACTORS.
+PAGE_EXTRACTOR = os.environ.get('PAGE_EXTRACTOR', 'streaming')
+PAGE_EXTRACTOR_MAIN_ONLY = os.environ.get('PAGE_EXTRACTOR_MAIN_ONLY', 'true').lower() == 'true'
+
+# Estimated tokens of source passages included in the plan generation prompt.
+CONTEXT_TOKEN_BUDGET = int(os.environ.get('CONTEXT_TOKEN_BUDGET', 6000))
+# Estimated tokens of source passages grounding subtopic content and quiz generation.
+GROUNDING_TOKEN_BUDGET = int(os.environ.get('GROUNDING_TOKEN_BUDGET', 3000))
+# Maximum number of subtopics whose questions are generated in a single LLM request.
+QUIZ_BATCH_MAX_SUBTOPICS = int(os.environ.get('QUIZ_BATCH_MAX_SUBTOPICS', 15))
+
+# Chat history sent with every turn: the pinned session context, a rolling summary of
+# older turns and the most recent turns verbatim, within a token budget.
+HISTORY_RECENT_TURNS = int(os.environ.get('HISTORY_RECENT_TURNS', 3))
+HISTORY_TOKEN_BUDGET = int(os.environ.get('HISTORY_TOKEN_BUDGET', 12000))
+HISTORY_SUMMARY_WORDS = int(os.environ.get('HISTORY_SUMMARY_WORDS', 250))
+
+# Streamed tokens are sent to the client in frames of up to STREAM_COALESCE_BYTES,
+# holding a token back for at most STREAM_COALESCE_DELAY seconds.
+STREAM_COALESCE_DELAY = float(os.environ.get('STREAM_COALESCE_DELAY', 0.05))
+STREAM_COALESCE_BYTES = int(os.environ.get('STREAM_COALESCE_BYTES', 1024))
+# A streamed reply is saved whenever this many seconds or characters passed since the last save.
+STREAM_SAVE_INTERVAL = float(os.environ.get('STREAM_SAVE_INTERVAL', 1))
+STREAM_SAVE_CHARACTERS = int(os.environ.get('STREAM_SAVE_CHARACTERS', 2000))
+# Seconds a reply keeps generating after its last reader disconnected, before the upstream stream is closed.
+STREAM_CANCEL_GRACE = float(os.environ.get('STREAM_CANCEL_GRACE', 10))
+# The process generating a reply records a heartbeat at least every STREAM_SAVE_INTERVAL. A reply without
+# one for this many seconds was abandoned by a dead process, it is read no further and marked truncated.
+STREAM_STALE_TIMEOUT = float(os.environ.get('STREAM_STALE_TIMEOUT', 10))
+
+# Source pages, system prompts, articles and chat messages are stored compressed with
+# TEXT_COMPRESSION_CODEC, one of chat_session.fields.CODECS, at TEXT_COMPRESSION_LEVEL.
+# Values shorter than TEXT_COMPRESSION_MIN_BYTES are stored uncompressed.
+TEXT_COMPRESSION_CODEC = os.environ.get('TEXT_COMPRESSION_CODEC', 'zlib')
+TEXT_COMPRESSION_LEVEL = int(os.environ.get('TEXT_COMPRESSION_LEVEL', 6))
+TEXT_COMPRESSION_MIN_BYTES = int(os.environ.get('TEXT_COMPRESSION_MIN_BYTES', 256))
+
+
+# Upstream HTTP clients
+# Process-wide keep-alive pools for the LLM provider, the search provider and source pages.
+
+UPSTREAM_CONNECT_TIMEOUT = float(os.environ.get('UPSTREAM_CONNECT_TIMEOUT', 3))
+UPSTREAM_READ_TIMEOUT = float(os.environ.get('UPSTREAM_READ_TIMEOUT', 15))
+LLM_READ_TIMEOUT = float(os.environ.get('LLM_READ_TIMEOUT', 120))
+UPSTREAM_MAX_RETRIES = int(os.environ.get('UPSTREAM_MAX_RETRIES', 3))
+UPSTREAM_BACKOFF_FACTOR = float(os.environ.get('UPSTREAM_BACKOFF_FACTOR', 0.5))
+UPSTREAM_BACKOFF_JITTER = float(os.environ.get('UPSTREAM_BACKOFF_JITTER', 0.5))
+# 413/429/503 responses are retried after their Retry-After header, waiting at most this many seconds.
+UPSTREAM_RETRY_AFTER_MAX = float(os.environ.get('UPSTREAM_RETRY_AFTER_MAX', 30))
+UPSTREAM_POOL_CONNECTIONS = int(os.environ.get('UPSTREAM_POOL_CONNECTIONS', 10))
+UPSTREAM_POOL_MAXSIZE = int(os.environ.get('UPSTREAM_POOL_MAXSIZE', 20))
+ASYNC_UPSTREAM_MAX_CONNECTIONS = int(os.environ.get('ASYNC_UPSTREAM_MAX_CONNECTIONS', 2000))
+UPSTREAM_CIRCUIT_FAILURES = int(os.environ.get('UPSTREAM_CIRCUIT_FAILURES', 5))
+UPSTREAM_CIRCUIT_RESET_TIMEOUT = float(os.environ.get('UPSTREAM_CIRCUIT_RESET_TIMEOUT', 30))
+
+
+# Caches
+# https://docs.djangoproject.com/en/5.1/topics/cache/
+# Database-backed caches are shared by every worker process; run `manage.py createcachetable`.
+
+SEARCH_CACHE_TTL = int(os.environ.get('SEARCH_CACHE_TTL', 60 * 60 * 24))
+SEARCH_CACHE_MAX_ENTRIES = int(os.environ.get('SEARCH_CACHE_MAX_ENTRIES', 10000))
+
+# Generated subtopic articles are shared across users by normalized subtopic name, plan topic,
+# model and prompt version. Articles older than the TTL are generated again.
+ARTICLE_CACHE_TTL = int(os.environ.get('ARTICLE_CACHE_TTL', 60 * 60 * 24 * 7))
+ARTICLE_CACHE_MAX_ENTRIES = int(os.environ.get('ARTICLE_CACHE_MAX_ENTRIES', 20000))
+
+# Parsed source pages are stored in the CachedPage table, revalidated once older than
+# the TTL and evicted least recently used first once over the byte budget. The job worker
+# evicts every PAGE_CACHE_EVICT_INTERVAL seconds, the cache may exceed the budget in between.
+PAGE_CACHE_TTL = int(os.environ.get('PAGE_CACHE_TTL', 60 * 60 * 24))
+PAGE_CACHE_MAX_BYTES = int(os.environ.get('PAGE_CACHE_MAX_BYTES', 512 * 1024 * 1024))
+PAGE_CACHE_EVICT_INTERVAL = float(os.environ.get('PAGE_CACHE_EVICT_INTERVAL', 5 * 60))
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'search': {
+        'BACKEND': 'django.core.cache.backends.db.DatabaseCache',
+        'LOCATION': 'search_cache',
+        'TIMEOUT': SEARCH_CACHE_TTL,
+        'OPTIONS': {
+            'MAX_ENTRIES': SEARCH_CACHE_MAX_ENTRIES,
+        }
+    },
+    'articles': {
+        'BACKEND': 'django.core.cache.backends.db.DatabaseCache',
+        'LOCATION': 'article_cache',
+        'TIMEOUT': ARTICLE_CACHE_TTL,
+        'OPTIONS': {
+            'MAX_ENTRIES': ARTICLE_CACHE_MAX_ENTRIES,
+        }
+    },
+}
+
+
+# Background jobs
+# Run by `manage.py run_jobs` workers, which are scaled separately from the web server.
+
+# Seconds an idle worker waits before looking for due jobs again.
+JOB_POLL_INTERVAL = float(os.environ.get('JOB_POLL_INTERVAL', 1))
+JOB_MAX_ATTEMPTS = int(os.environ.get('JOB_MAX_ATTEMPTS', 3))
+# A failed job is retried after JOB_RETRY_BACKOFF * 2 ** (attempt - 1) seconds plus jitter.
+JOB_RETRY_BACKOFF = float(os.environ.get('JOB_RETRY_BACKOFF', 5))
+# A job running for longer than this is considered abandoned by a dead worker and requeued.
+JOB_STALE_TIMEOUT = int(os.environ.get('JOB_STALE_TIMEOUT', 600))
+JOB_PROGRESS_POLL_INTERVAL = float(os.environ.get('JOB_PROGRESS_POLL_INTERVAL', 1))
+
+# Content of the first SUBTOPIC_PREFETCH_COUNT subtopics is generated as soon as a plan is
+# created, at most SUBTOPIC_PREFETCH_CONCURRENCY at a time across all workers and for at most
+# SUBTOPIC_PREFETCH_DAILY_BUDGET subtopics per user a day. A count of 0 disables prefetching.
+SUBTOPIC_PREFETCH_COUNT = int(os.environ.get('SUBTOPIC_PREFETCH_COUNT', 3))
+SUBTOPIC_PREFETCH_CONCURRENCY = int(os.environ.get('SUBTOPIC_PREFETCH_CONCURRENCY', 4))
+SUBTOPIC_PREFETCH_DAILY_BUDGET = int(os.environ.get('SUBTOPIC_PREFETCH_DAILY_BUDGET', 30))
+
+# Maximum number of running jobs per kind, kinds not listed are limited only by the number of workers.
+JOB_KIND_CONCURRENCY = {
+    'prefetch_subtopic_content': SUBTOPIC_PREFETCH_CONCURRENCY,
+}
@@ -6,5 +6,6 @@ urlpatterns = [
     path('admin/', admin.site.urls),
     path('auth/', include('account.urls')),
     path('chats/', include('chat_session.urls')),
-    path('plans/', include('plan.urls'))
+    path('plans/', include('plan.urls')),
+    path('jobs/', include('job.urls'))
 ]
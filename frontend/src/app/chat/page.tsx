@@ -107,60 +107,97 @@ export default function ChatPage() {
     setMessages(prev => [...prev, { role: 'user', content: userMessage }]);
     setUserMessage('');
 
-    try {
-      const response = await fetch(`${process.env.NEXT_PUBLIC_API_URL}/chats/${selectedPlan}/send_message/`, {
-        method: 'POST',
-        headers: {
-          'Authorization': `Bearer ${cookies.access}`,
-          'Content-Type': 'application/json',
-        },
-        body: JSON.stringify({ message: userMessage }),
+    let assistantContent = "";
+    let lastEventId: string | null = null;
+    let reconnects = 0;
+
+    const renderAssistantMessage = async () => {
+      const html = await convertMarkdown(assistantContent);
+      setMessages(prevMessages => {
+        const updatedMessages = [...prevMessages];
+        const lastMessageIndex = updatedMessages.length - 1;
+        if (lastMessageIndex >= 0) {
+          updatedMessages[lastMessageIndex] = { role: 'assistant', content: html };
+        }
+        return updatedMessages;
       });
+    };
 
-      if (response.ok) {
-        setIsSending(false);
+    try {
+      while (true) {
+        // After a dropped connection, Last-Event-ID resumes the same reply instead of sending the message again.
+        const response = await fetch(`${process.env.NEXT_PUBLIC_API_URL}/chats/${selectedPlan}/send_message/`, {
+          method: 'POST',
+          headers: {
+            'Authorization': `Bearer ${cookies.access}`,
+            'Content-Type': 'application/json',
+            ...(lastEventId ? { 'Last-Event-ID': lastEventId } : {}),
+          },
+          body: JSON.stringify(lastEventId ? {} : { message: userMessage }),
+        });
+
+        if (!response.ok) {
+          if (!lastEventId) {
+            toast('An error occurred while sending message', {
+              description: 'You have reached the maximum allowed limit of 20 messages per session.'
+            })
+          }
+          break;
+        }
+
+        if (!lastEventId) {
+          setIsSending(false);
+          setMessages(prev => [...prev, { role: 'assistant', content: '' }]);
+        }
 
         const reader = response.body?.getReader();
         const decoder = new TextDecoder();
-        let done = false;
-        let assistantContent = "";
+        let buffer = "";
 
-        setMessages(prev => [...prev, { role: 'assistant', content: '' }]);
+        try {
+          while (true) {
+            const { value, done } = await reader?.read()!;
+            if (done) break;
 
-        while (!done) {
-          const { value, done: streamDone } = await reader?.read()!;
-          done = streamDone;
-          if (value) {
-            let chunk = decoder.decode(value, { stream: true });
-            const payloads = chunk.toString().split('\n\n');
+            // Events can be split across network chunks, only complete ones are parsed.
+            buffer += decoder.decode(value, { stream: true });
+            const events = buffer.split('\n\n');
+            buffer = events.pop() ?? "";
 
-            for (const payload of payloads) {
-              if (payload.startsWith('data:')) {
-                const data = payload.replace('data: ', '');
-                assistantContent += data.replaceAll('\\n', '\n');
-                const html = await convertMarkdown(assistantContent);
+            for (const event of events) {
+              let eventType = 'message';
+              let data: string | null = null;
 
-                setMessages(prevMessages => {
-                  const updatedMessages = [...prevMessages];
-                  const lastMessageIndex = updatedMessages.length - 1;
-                  if (lastMessageIndex >= 0) {
-                    updatedMessages[lastMessageIndex] = { role: 'assistant', content: html };
-                  }
-                  return updatedMessages;
-                });
+              for (const line of event.split('\n')) {
+                if (line.startsWith('id:')) {
+                  lastEventId = line.slice(3).trim();
+                } else if (line.startsWith('event:')) {
+                  eventType = line.slice(6).trim();
+                } else if (line.startsWith('data:')) {
+                  data = line.slice(5).replace(/^ /, '');
+                }
+              }
+
+              if (data === null) continue;
+              if (eventType === 'error') {
+                toast('An error occurred while generating the reply', { description: data });
+              } else {
+                assistantContent += data.replaceAll('\\n', '\n');
+                await renderAssistantMessage();
               }
             }
           }
+          break;
+        } catch (error) {
+          if (!lastEventId || reconnects >= 3) throw error;
+          reconnects++;
         }
-      } else {
-        toast('An error occurred while sending message', {
-          description: 'You have reached the maximum allowed limit of 20 messages per session.'
-        })
       }
-      setIsGenerating(false);
     } catch (error) {
       console.error(error);
     }
+    setIsSending(false);
+    setIsGenerating(false);
   };
 
   const handleInputChange = (e: React.ChangeEvent<HTMLTextAreaElement>) => {
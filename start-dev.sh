@@ -19,7 +19,8 @@ cleanup() {
     docker compose stop db
 
     jobs -p | xargs kill
-    pkill -f "manage.py runserver"
+    pkill -f "uvicorn study_helper.asgi"
+    pkill -f "manage.py run_jobs"
 }
 
 trap cleanup SIGINT SIGTERM
@@ -36,7 +37,11 @@ fi
 
 pip install -r requirements.txt
 python3 manage.py migrate
-python3 manage.py runserver &
+# The search cache lives in a database table, which migrate does not create.
+python3 manage.py createcachetable
+# Replies are streamed by tasks on the server event loop, which needs ASGI rather than runserver.
+uvicorn study_helper.asgi:application --reload --port 8000 &
+python3 manage.py run_jobs &
 
 echo "Starting Next.js frontend..."
 cd ../frontend && npm ci && npm run dev &